@@ -0,0 +1,141 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+
+from qgis.core import QgsApplication, QgsSettings
+
+from .utils.logger import Logger
+
+Log = Logger()
+
+
+class ResponseCache:
+    """Persistent, size-bounded cache for raw API responses.
+
+    Responses are stored zlib compressed in a SQLite database inside the
+    QGIS profile directory. Entries older than ``ttl`` seconds are treated
+    as misses, but can still be served when the network is unavailable.
+    Whenever the stored data exceeds ``max_size`` bytes the least recently
+    used entries are evicted.
+    """
+
+    _lock = threading.Lock()
+    _initialized = set()
+
+    def __init__(self, path, ttl, max_size):
+        self.path = path
+        self.ttl = ttl
+        self.max_size = max_size
+        self.initDatabase()
+
+    @classmethod
+    def fromSettings(cls):
+        """Return the cache configured in the plugin settings or None."""
+        settings = QgsSettings()
+        if not settings.value("/KgrFinder/cache_enabled", True, type=bool):
+            return None
+
+        path = os.path.join(
+            QgsApplication.qgisSettingsDirPath(),
+            "kgr_finder",
+            "response_cache.sqlite",
+        )
+        ttl_hours = settings.value("/KgrFinder/cache_ttl_hours", 168, type=float)
+        max_size_mb = settings.value("/KgrFinder/cache_max_size_mb", 256, type=float)
+        return cls(path, ttl_hours * 3600, int(max_size_mb * 1024 * 1024))
+
+    @staticmethod
+    def makeKey(**parts):
+        normalized = json.dumps(parts, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+    @contextmanager
+    def transaction(self):
+        connection = sqlite3.connect(self.path, timeout=30)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def initDatabase(self):
+        with self._lock:
+            if self.path in self._initialized:
+                return
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with self.transaction() as connection:
+                connection.execute("PRAGMA journal_mode=WAL")
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS responses ("
+                    "key TEXT PRIMARY KEY, "
+                    "created REAL NOT NULL, "
+                    "accessed REAL NOT NULL, "
+                    "size INTEGER NOT NULL, "
+                    "data BLOB NOT NULL)"
+                )
+                connection.execute(
+                    "CREATE INDEX IF NOT EXISTS responses_accessed "
+                    "ON responses (accessed)"
+                )
+            self._initialized.add(self.path)
+
+    def get(self, key, allow_expired=False):
+        """Return the cached response for ``key`` or None on a miss."""
+        now = time.time()
+        with self._lock, self.transaction() as connection:
+            row = connection.execute(
+                "SELECT created, data FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+
+            created, data = row
+            if not allow_expired and self.ttl and now - created > self.ttl:
+                return None
+
+            connection.execute(
+                "UPDATE responses SET accessed = ? WHERE key = ?", (now, key)
+            )
+
+        return zlib.decompress(data)
+
+    def put(self, key, content):
+        data = zlib.compress(content)
+        now = time.time()
+        with self._lock, self.transaction() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO responses "
+                "(key, created, accessed, size, data) VALUES (?, ?, ?, ?, ?)",
+                (key, now, now, len(data), sqlite3.Binary(data)),
+            )
+            self.evict(connection)
+
+    def evict(self, connection):
+        """Drop least recently used entries until the size cap is met."""
+        total = connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()[0]
+        if total <= self.max_size:
+            return
+
+        evicted = 0
+        rows = connection.execute(
+            "SELECT key, size FROM responses ORDER BY accessed ASC"
+        ).fetchall()
+        for key, size in rows:
+            if total <= self.max_size:
+                break
+            connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+            evicted += 1
+
+        Log.log_debug(f"evicted {evicted} cached responses")
+
+    def clear(self):
+        with self._lock, self.transaction() as connection:
+            connection.execute("DELETE FROM responses")
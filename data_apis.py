@@ -1,24 +1,77 @@
-import copy
+import itertools
 import json
+import math
+import threading
+import time
 import urllib.parse
 from abc import ABC, abstractmethod
+from array import array
 
-from qgis.core import (Qgis, QgsCoordinateReferenceSystem,
-                       QgsCoordinateTransform, QgsNetworkAccessManager,
-                       QgsPointXY, QgsProject, QgsSettings)
-from qgis.PyQt.QtCore import QUrl
+from qgis.core import (QgsCoordinateReferenceSystem, QgsCoordinateTransform,
+                       QgsGeometry, QgsNetworkAccessManager, QgsPointXY,
+                       QgsProject, QgsSettings, QgsWkbTypes)
+from qgis.PyQt.QtCore import QByteArray, QUrl
 from qgis.PyQt.QtNetwork import QNetworkRequest
-from qgis.utils import iface
 
+try:
+    import numpy
+    import pyproj
+except ImportError:
+    numpy = pyproj = None
+
+from .cache import ResponseCache
+from .executor import ConcurrentExecutor
+from .utils.json_stream import JSONArrayStream, iter_chunks
 from .utils.logger import Logger
+from .utils.overpass import (assemble_multipolygon, overpass_query,
+                             restructure_elements)
+from .utils.tiles import tile_bbox, tile_count, tiles_for_bbox
 
 Log = Logger()
 
+# Placeholder for the current project CRS in transform cache keys
+PROJECT_CRS = "project"
+
+
 class APIQueryStrategy(ABC):
     source = None
+    # Error string of the last failed request, reported once the query task
+    # is back on the main thread.
+    last_error = None
+    # Set when a request failed for good, so the results miss some data
+    incomplete = False
+    # Overloaded or timed out servers, worth retrying after a pause
+    retry_status_codes = (429, 503, 504)
+    # Coordinate transforms shared by all strategies, keyed by the auth ids
+    # of source and destination CRS
+    _transforms = {}
+    # pyproj transformers are not thread safe, every thread has its own
+    # cache, dropped when _transform_generation changes
+    _proj_transformers = threading.local()
+    _transform_generation = 0
+    _project_signals_connected = False
+
+    def __init__(self):
+        self.connectProjectSignals()
+
+    def resetStatus(self):
+        """Forget the errors of the last query. Called once per query task,
+        as a strategy queries several areas concurrently."""
+        self.last_error = None
+        self.incomplete = False
 
     @abstractmethod
-    def query(self, selected_tags, x_min, y_min, x_max, y_max):
+    def query(
+        self, x_min, y_min, x_max, y_max, feedback=None, survey_features=None
+    ):
+        """Fetch and parse the data for the given extent.
+
+        Runs inside a background task, so implementations must not touch
+        any GUI object. ``feedback`` is a QgsFeedback used to abort
+        pending network requests when the task is canceled.
+        ``survey_features`` are the survey polygons in project CRS, which
+        strategies may use to narrow the request down further.
+        """
         pass
 
     @abstractmethod
@@ -31,118 +84,607 @@ class APIQueryStrategy(ABC):
 
     @abstractmethod
     def extractLatLon(self, element):
+        """Return the (lat, lon) of a point element in EPSG:4326."""
+        pass
+
+    @abstractmethod
+    def extractPolygonNodes(self, element):
+        """Return the (lon, lat) ring of a polygon element in EPSG:4326."""
         pass
 
     @abstractmethod
     def getGeometryType(self, element):
         pass
 
-    def transformTo4326(self, x, y):
-        if x is not None and y is not None:
-            project = QgsProject.instance()
-            project_crs = project.crs()
-            target_crs = QgsCoordinateReferenceSystem("EPSG:4326")
-            transform = QgsCoordinateTransform(project_crs, target_crs, project)
-            pt = QgsPointXY(x, y)
-            pt = transform.transform(pt)
-            return pt.x(), pt.y()
-        return None, None
+    def isCacheable(self, content):
+        return True
+
+    def expectedElementCount(self, data):
+        """Number of elements ``extractElements`` is going to yield, used for
+        progress reporting only."""
+        elements = self.extractElements(data)
+        return len(elements) if hasattr(elements, "__len__") else 0
+
+    def progressFraction(self, data, consumed):
+        """Return the part of the response processed once ``consumed``
+        elements were taken from ``extractElements``, between 0 and 1."""
+        expected = self.expectedElementCount(data)
+        return min(consumed / expected, 1) if expected else 0
+
+    def roundBBox(self, x_min, y_min, x_max, y_max, digits=3):
+        """Round a 4326 bbox outwards, so slightly different survey areas
+        share one cache entry while the rounded bbox still covers them."""
+        factor = 10**digits
+        return (
+            math.floor(x_min * factor) / factor,
+            math.floor(y_min * factor) / factor,
+            math.ceil(x_max * factor) / factor,
+            math.ceil(y_max * factor) / factor,
+        )
 
-    def transformCoordinates(self, x, y):
-        if x is not None and y is not None:
-            project = QgsProject.instance()
-            api_crs = QgsCoordinateReferenceSystem("EPSG:4326")
-            target_crs = QgsProject.instance().crs()
-            transform = QgsCoordinateTransform(api_crs, target_crs, project)
-            pt = QgsPointXY(x, y)
-            pt = transform.transform(pt)
-            return pt.y(), pt.x()
-        return None, None
+    def fetch(self, url, cache_key=None, feedback=None, post_data=None):
+        """Return the raw response body of ``url`` as bytes or None.
+
+        ``post_data`` is sent form encoded in a POST request, which is not
+        bound by URL length limits. Fresh responses are served from the
+        on-disk cache when available. If the request fails an expired cache
+        entry is used instead, so areas that were queried before also work
+        offline.
+        """
+        cache = ResponseCache.fromSettings() if cache_key else None
+        if cache is not None:
+            content = cache.get(cache_key)
+            if content is not None:
+                Log.log_debug(f"cache hit for {url}")
+                return content
+
+        max_retries = QgsSettings().value("/KgrFinder/max_retries", 3, type=int)
+        for attempt in range(max_retries + 1):
+            reply = self.request(url, feedback, post_data)
+            status = reply.attribute(QNetworkRequest.HttpStatusCodeAttribute)
+            if (
+                not reply.error()
+                or status not in self.retry_status_codes
+                or attempt == max_retries
+            ):
+                break
+            delay = self.retryDelay(reply, attempt)
+            Log.log_debug(f"HTTP {status} for {url}, retrying in {delay} s")
+            if not self.wait(delay, feedback):
+                break
+
+        if reply.error():
+            if reply.errorString():
+                self.last_error = reply.errorString()
+                Log.log_error(reply.errorString())
+            content = None
+            if cache is not None:
+                content = cache.get(cache_key, allow_expired=True)
+            if content is None and not (feedback is not None and feedback.isCanceled()):
+                self.incomplete = True
+            return content
 
+        content = bytes(reply.content())
+        if content and cache is not None and self.isCacheable(content):
+            cache.put(cache_key, content)
 
-class OverpassAPIQueryStrategy(APIQueryStrategy):
-    source = "Open Street Map"
+        return content or None
 
-    def restructure_data(self, new_data):
-        nodes = {
-            element["id"]: (element["lat"], element["lon"])
-            for element in new_data["elements"]
-            if element["type"] == "node"
-        }
-        ways = {
-            element["id"]: element
-            for element in new_data["elements"]
-            if element["type"] == "way"
-        }
+    def request(self, url, feedback=None, post_data=None):
+        Log.log_debug(f"called url {url}")
+        request = QNetworkRequest(QUrl(url))
+        if post_data is not None:
+            request.setHeader(
+                QNetworkRequest.ContentTypeHeader,
+                "application/x-www-form-urlencoded",
+            )
+            body = QByteArray(urllib.parse.urlencode(post_data).encode("utf-8"))
+            return QgsNetworkAccessManager.instance().blockingPost(
+                request, body, "", False, feedback
+            )
+        return QgsNetworkAccessManager.instance().blockingGet(
+            request, "", False, feedback
+        )
 
-        # Build a set of all possible node IDs of all ways
-        possible_node_ids = set()
-        for way_id, node_ids in ways.items():
-            possible_node_ids.update(node_ids["nodes"])
+    def retryDelay(self, reply, attempt):
+        """Return the seconds to wait before retrying, the Retry-After header
+        of the server if given, otherwise an exponential backoff."""
+        retry_after = bytes(reply.rawHeader(QByteArray(b"Retry-After"))).strip()
+        if retry_after.isdigit():
+            return min(int(retry_after), 120)
+        return min(2 * 2**attempt, 60)
+
+    def wait(self, seconds, feedback=None):
+        """Sleep, returning False early when ``feedback`` gets canceled."""
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            if feedback is not None and feedback.isCanceled():
+                return False
+            time.sleep(0.2)
+        return True
+
+    @classmethod
+    def connectProjectSignals(cls):
+        """Drop cached transforms whenever the project CRS or its datum
+        transformations change. Must be called on the main thread."""
+        if APIQueryStrategy._project_signals_connected:
+            return
+        project = QgsProject.instance()
+        project.crsChanged.connect(APIQueryStrategy.clearTransformCache)
+        project.transformContextChanged.connect(
+            APIQueryStrategy.clearTransformCache
+        )
+        APIQueryStrategy._project_signals_connected = True
+
+    @staticmethod
+    def clearTransformCache():
+        APIQueryStrategy._transforms.clear()
+        APIQueryStrategy._transform_generation += 1
+
+    @staticmethod
+    def cachedTransform(source, destination):
+        """Return a QgsCoordinateTransform between two CRS auth ids, where
+        PROJECT_CRS stands for the current project CRS."""
+        key = (source, destination)
+        transform = APIQueryStrategy._transforms.get(key)
+        if transform is None:
+            project = QgsProject.instance()
+            source_crs, destination_crs = [
+                project.crs()
+                if crs == PROJECT_CRS
+                else QgsCoordinateReferenceSystem(crs)
+                for crs in key
+            ]
+            transform = QgsCoordinateTransform(source_crs, destination_crs, project)
+            APIQueryStrategy._transforms[key] = transform
+        return transform
 
-        # Filter out nodes where their ID is not in the list of possible node IDs
-        new_data["elements"] = [
-            element
-            for element in new_data["elements"]
-            if element["type"] != "node" or element["id"] not in possible_node_ids
+    def transformTo4326(self, x, y):
+        if x is not None and y is not None:
+            transform = self.cachedTransform(PROJECT_CRS, "EPSG:4326")
+            pt = transform.transform(QgsPointXY(x, y))
+            return pt.x(), pt.y()
+        return None, None
+
+    @staticmethod
+    def cachedProjTransformer(source, destination):
+        """Return a pyproj Transformer like ``cachedTransform``, or None when
+        pyproj cannot reproduce the QGIS transformation."""
+        local = APIQueryStrategy._proj_transformers
+        if getattr(local, "generation", None) != APIQueryStrategy._transform_generation:
+            local.transformers = {}
+            local.generation = APIQueryStrategy._transform_generation
+
+        key = (source, destination)
+        if key not in local.transformers:
+            local.transformers[key] = APIQueryStrategy.createProjTransformer(
+                source, destination
+            )
+        return local.transformers[key]
+
+    @staticmethod
+    def createProjTransformer(source, destination):
+        project = QgsProject.instance()
+        source_crs, destination_crs = [
+            project.crs() if crs == PROJECT_CRS else QgsCoordinateReferenceSystem(crs)
+            for crs in (source, destination)
         ]
+        # Datum transformations chosen in the project are only applied by QGIS
+        if project.transformContext().calculateCoordinateOperation(
+            source_crs, destination_crs
+        ):
+            return None
 
-        # Move nodes under the corresponding way element
-        for way_id, node_ids in ways.items():
-            way_nodes = [
-                ({"lon": nodes[node_id][1], "lat": nodes[node_id][0]})
-                for node_id in node_ids["nodes"]
-                if node_id in nodes
-            ]
-            ways[way_id]["nodes"] = way_nodes
+        definitions = []
+        for crs in (source_crs, destination_crs):
+            # pyproj does not know QGIS user CRSs such as USER:100000
+            if crs.authid().split(":")[0] in ("EPSG", "ESRI"):
+                definitions.append(crs.authid())
+            else:
+                definitions.append(crs.toWkt())
+        try:
+            return pyproj.Transformer.from_crs(*definitions, always_xy=True)
+        except pyproj.exceptions.CRSError as e:
+            Log.log_debug(f"pyproj cannot transform {definitions}: {e}")
+            return None
+
+    def buildGeometries(self, elements, destination=PROJECT_CRS):
+        """Return a QgsGeometry in the ``destination`` CRS for every element,
+        or None for elements without a usable geometry.
+
+        With NumPy and pyproj installed, the coordinates of all elements are
+        gathered into two contiguous arrays, reprojected in a single call
+        and scattered back into the geometries. Otherwise, or when the
+        project chose a datum transformation or the CRS is unknown to pyproj,
+        every geometry is built in EPSG:4326 and reprojected as a whole by
+        QgsGeometry.transform.
+        For an EPSG:4326 destination the API coordinates are used as they are.
+        """
+        shapes = []
+        for element in elements:
+            geometry_type = self.getGeometryType(element)
+            coordinates = None
+            if geometry_type == "point":
+                lat, lon = self.extractLatLon(element)
+                if lat is not None and lon is not None:
+                    coordinates = [(lon, lat)]
+            elif geometry_type in ("polygon", "multipolygon"):
+                coordinates = self.extractPolygonNodes(element)
+            shapes.append((geometry_type, coordinates) if coordinates else None)
+
+        if destination == "EPSG:4326":
+            return [self.createGeometry(*shape) if shape else None for shape in shapes]
+
+        transformer = None
+        if pyproj is not None and numpy is not None:
+            transformer = self.cachedProjTransformer("EPSG:4326", destination)
+        if transformer is not None:
+            return self.buildGeometriesVectorized(shapes, transformer)
+
+        transform = self.cachedTransform("EPSG:4326", destination)
+        geometries = []
+        for shape in shapes:
+            if shape is None:
+                geometries.append(None)
+                continue
+            geometry = self.createGeometry(*shape)
+            geometry.transform(transform)
+            geometries.append(geometry)
+        return geometries
+
+    def buildGeometriesVectorized(self, shapes, transformer):
+        xs = array("d")
+        ys = array("d")
+        for shape in shapes:
+            if shape is not None:
+                for ring in self.shapeRings(*shape):
+                    for x, y in ring:
+                        xs.append(x)
+                        ys.append(y)
+
+        if not xs:
+            return [None] * len(shapes)
+
+        xs, ys = transformer.transform(numpy.frombuffer(xs), numpy.frombuffer(ys))
+        xs = xs.tolist()
+        ys = ys.tolist()
+
+        geometries = []
+        start = 0
+        for shape in shapes:
+            if shape is None:
+                geometries.append(None)
+                continue
+            geometry_type, coordinates = shape
+            rings = []
+            for ring in self.shapeRings(geometry_type, coordinates):
+                end = start + len(ring)
+                rings.append(zip(xs[start:end], ys[start:end]))
+                start = end
+            if geometry_type == "multipolygon":
+                rings = iter(rings)
+                coordinates = [
+                    [next(rings) for _ in polygon] for polygon in coordinates
+                ]
+            else:
+                coordinates = rings[0]
+            geometries.append(self.createGeometry(geometry_type, coordinates))
+        return geometries
+
+    def shapeRings(self, geometry_type, coordinates):
+        """Return the coordinate rings of a shape, the single ring of points
+        and polygons or all rings of all parts of a multipolygon."""
+        if geometry_type == "multipolygon":
+            return [ring for polygon in coordinates for ring in polygon]
+        return [coordinates]
+
+    def createGeometry(self, geometry_type, coordinates):
+        """Create the geometry of a shape. Polygons are created as single
+        part multipolygons, the geometry type of the result layer."""
+        if geometry_type == "multipolygon":
+            return QgsGeometry.fromMultiPolygonXY(
+                [
+                    [[QgsPointXY(x, y) for x, y in ring] for ring in polygon]
+                    for polygon in coordinates
+                ]
+            )
+        points = [QgsPointXY(x, y) for x, y in coordinates]
+        if geometry_type == "point":
+            return QgsGeometry.fromPointXY(points[0])
+        return QgsGeometry.fromMultiPolygonXY([[points]])
 
-        return new_data
 
-    def query(self, x_min, y_min, x_max, y_max):
+class OverpassAPIQueryStrategy(APIQueryStrategy):
+    source = "Open Street Map"
+    # Deepest zoom a tile is split to when Overpass times out on it
+    max_split_zoom = 18
+    # "nodes" resolves way geometries from the member nodes on the client,
+    # "geom" lets Overpass inline them and "center" only returns way centers
+    geometry_mode = "nodes"
+
+    def restructure_data(self, elements, selected_tags):
+        return restructure_elements(elements, selected_tags)
+
+    def query(
+        self, x_min, y_min, x_max, y_max, feedback=None, survey_features=None
+    ):
+        """Query the fixed tile grid covering the extent.
+
+        The 4326 bbox is split into web mercator tiles at the
+        ``/KgrFinder/tile_zoom`` level. Every tile is cached on its own, so
+        overlapping survey areas only download the tiles not seen before.
+        Missing tiles are requested with at most
+        ``/KgrFinder/overpass_parallel_requests`` requests in flight, and
+        elements of all tiles are merged and deduplicated by OSM id.
+        The elements are decoded lazily while they are consumed.
+
+        With the "Filter OSM by survey polygons" query option the survey
+        polygons themselves are sent as poly: filters instead, see
+        ``queryPolygons``.
+        """
         x_min, y_min = self.transformTo4326(x_min, y_min)
         x_max, y_max = self.transformTo4326(x_max, y_max)
 
         selected_cultural_tags = QgsSettings().value("/KgrFinder/osm_tags", [])
         custom_osm_tags = QgsSettings().value("/KgrFinder/custom_osm_tags", [])
         selected_tags = selected_cultural_tags + custom_osm_tags
+        self.geometry_mode = QgsSettings().value(
+            "/KgrFinder/overpass_geometry_mode", "nodes"
+        )
 
+        query_options = QgsSettings().value("/KgrFinder/query_options", [])
+        if survey_features and "Filter OSM by survey polygons" in query_options:
+            poly_filters = self.createPolyFilters(survey_features)
+            if poly_filters:
+                progress = {"done": 0, "total": 0}
+                return {
+                    "elements": self.queryPolygons(
+                        selected_tags,
+                        poly_filters,
+                        (x_min, y_min, x_max, y_max),
+                        feedback,
+                        progress,
+                    ),
+                    "progress": progress,
+                }
+
+        tiles = self.gridTiles(x_min, y_min, x_max, y_max)
+        progress = {"done": 0, "total": len(tiles)}
+        return {
+            "elements": self.iterTiles(selected_tags, tiles, feedback, progress),
+            "progress": progress,
+        }
+
+    def progressFraction(self, data, consumed):
+        # The elements are streamed, progress is counted in finished tiles
+        # or in bytes of the response decoded, see query
+        progress = data.get("progress") if data else None
+        if not progress or not progress["total"]:
+            return 0
+        return min(progress["done"] / progress["total"], 1)
+
+    def gridTiles(self, x_min, y_min, x_max, y_max):
+        zoom = QgsSettings().value("/KgrFinder/tile_zoom", 12, type=int)
+        max_tiles = QgsSettings().value("/KgrFinder/max_tiles", 64, type=int)
+        # Fall back to a coarser grid instead of firing hundreds of requests
+        while zoom > 0 and tile_count(x_min, y_min, x_max, y_max, zoom) > max_tiles:
+            zoom -= 1
+
+        tiles = tiles_for_bbox(x_min, y_min, x_max, y_max, zoom)
+        Log.log_debug(f"querying {len(tiles)} tiles at zoom {zoom}")
+        return tiles
+
+    def iterTiles(self, selected_tags, tiles, feedback=None, progress=None):
+        """Yield the elements of all tiles, counting finished tiles in
+        ``progress["done"]``."""
+        parallel_requests = QgsSettings().value(
+            "/KgrFinder/overpass_parallel_requests", 2, type=int
+        )
+        executor = ConcurrentExecutor(max_workers=parallel_requests, feedback=feedback)
+
+        def queryTile(tile, tile_feedback):
+            return self.queryTile(selected_tags, tile, tile_feedback)
+
+        seen = set()
+        for tile, elements, error in executor.run(queryTile, tiles):
+            if error is not None:
+                self.last_error = str(error)
+                self.incomplete = True
+                Log.log_error(f"tile {tile} failed: {error!r}")
+                continue
+
+            for element in elements:
+                key = (element["type"], element["id"])
+                if key not in seen:
+                    seen.add(key)
+                    yield element
+            if progress is not None:
+                progress["done"] += 1
+
+    def queryTile(self, selected_tags, tile, feedback=None):
+        """Query one tile, splitting it into its four children whenever
+        Overpass gives up on it with a timeout or runtime error remark.
+
+        Returns an iterator over the elements of the tile.
+        """
+        if feedback is not None and feedback.isCanceled():
+            return iter(())
+
+        tile_x_min, tile_y_min, tile_x_max, tile_y_max = tile_bbox(*tile)
         overpass_query = self.createOverpassQuery(
-            selected_tags, x_min, y_min, x_max, y_max
+            selected_tags, tile_x_min, tile_y_min, tile_x_max, tile_y_max
         )
 
         url = f"https://overpass-api.de/api/interpreter?data={overpass_query}"
-        Log.log_debug(f"called url {url}")
-
-        request = QNetworkRequest(QUrl(url))
-        reply = QgsNetworkAccessManager.instance().blockingGet(request)
-
-        if reply.error():
-            if reply.errorString():
-                Log.log_error(reply.errorString())
-
-        if reply.content():
-            data = str(reply.content(), "utf-8")
-            data = json.loads(data)
-            new_data = copy.deepcopy(data)
-            new_data = self.restructure_data(new_data)
-            return new_data
-
-        return None
+        cache_key = ResponseCache.makeKey(
+            source=self.source,
+            tags=sorted(set(selected_tags)),
+            tile=list(tile),
+            mode=self.geometry_mode,
+        )
+        content = self.fetch(url, cache_key, feedback)
+
+        if not content:
+            return iter(())
+
+        zoom, x, y = tile
+        if self.isIncomplete(content) and zoom < self.max_split_zoom:
+            Log.log_debug(f"splitting tile {tile}")
+            children = (
+                (zoom + 1, 2 * x, 2 * y),
+                (zoom + 1, 2 * x + 1, 2 * y),
+                (zoom + 1, 2 * x, 2 * y + 1),
+                (zoom + 1, 2 * x + 1, 2 * y + 1),
+            )
+            return itertools.chain.from_iterable(
+                self.queryTile(selected_tags, child, feedback) for child in children
+            )
+
+        if self.isIncomplete(content):
+            # Cannot be split any further, keep the partial result
+            self.last_error = f"Overpass did not finish tile {tile}"
+            self.incomplete = True
+            Log.log_error(f"tile {tile} is incomplete")
+
+        elements = JSONArrayStream(iter_chunks(content), "elements")
+        if self.geometry_mode == "nodes":
+            return self.restructure_data(elements, selected_tags)
+        return iter(elements)
+
+    def queryPolygons(
+        self, selected_tags, poly_filters, extent, feedback=None, progress=None
+    ):
+        """Query the survey polygons with poly: filters in one POST request.
+
+        Falls back to the tile grid, which splits adaptively, when Overpass
+        cannot answer the polygon query completely. ``progress`` counts the
+        decoded bytes of the response, or the finished tiles.
+        """
+        if progress is None:
+            progress = {"done": 0, "total": 0}
+        overpass_query = self.createOverpassQuery(
+            selected_tags, *extent, poly_filters=poly_filters
+        )
+        url = "https://overpass-api.de/api/interpreter"
+        cache_key = ResponseCache.makeKey(
+            source=self.source,
+            tags=sorted(set(selected_tags)),
+            poly=poly_filters,
+            mode=self.geometry_mode,
+        )
+        content = self.fetch(url, cache_key, feedback, {"data": overpass_query})
+
+        if content and self.isIncomplete(content):
+            Log.log_debug("polygon query incomplete, falling back to tiles")
+            tiles = self.gridTiles(*extent)
+            progress["total"] = len(tiles)
+            yield from self.iterTiles(selected_tags, tiles, feedback, progress)
+            return
+
+        if not content:
+            return
+
+        progress["total"] = len(content)
+
+        def countedChunks():
+            for chunk in iter_chunks(content):
+                progress["done"] += len(chunk)
+                yield chunk
+
+        elements = JSONArrayStream(countedChunks(), "elements")
+        if self.geometry_mode == "nodes":
+            elements = self.restructure_data(elements, selected_tags)
+        yield from elements
+
+    def createPolyFilters(self, survey_features):
+        """Return the survey polygons as Overpass poly: coordinate strings.
+
+        Overlapping polygons are merged first. Every polygon is simplified
+        to its share of ``/KgrFinder/poly_max_vertices`` vertices, so the
+        request stays small. Returns None when there are more polygons than
+        ``/KgrFinder/poly_max_polygons``, the tile grid is used then.
+        """
+        max_vertices = QgsSettings().value(
+            "/KgrFinder/poly_max_vertices", 500, type=int
+        )
+        max_polygons = QgsSettings().value(
+            "/KgrFinder/poly_max_polygons", 25, type=int
+        )
 
-    def createOverpassQuery(self, tags, x_min, y_min, x_max, y_max):
-        overpass_query = "[out:json];("
+        geometries = [
+            feature.geometry()
+            for feature in survey_features
+            if feature.hasGeometry()
+            and feature.geometry().type() == QgsWkbTypes.PolygonGeometry
+        ]
+        if not geometries:
+            return None
 
-        for search_term in tags:
-            key, sep, value = search_term.partition("=")
-            key, value = [f"'{value}'" if value else "" for value in (key, value)]
+        transform = self.cachedTransform(PROJECT_CRS, "EPSG:4326")
+        union = QgsGeometry.unaryUnion(geometries)
+        union.transform(transform)
+        parts = [
+            part
+            for part in union.asGeometryCollection()
+            if part.type() == QgsWkbTypes.PolygonGeometry
+        ]
+        if not parts or len(parts) > max_polygons:
+            Log.log_debug(f"{len(parts)} survey polygons, using the tile grid")
+            return None
 
-            query = f"node[{key}{sep}{value}]({y_min},{x_min},{y_max},{x_max});"
-            query += f"way[{key}{sep}{value}]({y_min},{x_min},{y_max},{x_max});>;"
-            # query += f'relation["{tag}"]({y_min},{x_min},{y_max},{x_max});'
-            overpass_query += query
+        budget = max(4, max_vertices // len(parts))
+        return [
+            " ".join(f"{y:.6f} {x:.6f}" for x, y in self.simplifyPolygon(part, budget))
+            for part in parts
+        ]
 
-        overpass_query += ");out;"
-        return overpass_query
+    def simplifyPolygon(self, geometry, max_vertices):
+        """Return the exterior ring of ``geometry`` with at most
+        ``max_vertices`` vertices, still covering the original polygon.
+
+        The ring is buffered by the simplification tolerance before it is
+        simplified, as Douglas-Peucker may cut into the polygon by up to
+        that tolerance. Holes are dropped, they never matter for a filter.
+        """
+        polygon = QgsGeometry.fromPolygonXY([geometry.asPolygon()[0]])
+        rect = polygon.boundingBox()
+        diagonal = math.hypot(rect.width(), rect.height()) or 1e-6
+        tolerance = diagonal / 1000
+        candidate = polygon
+
+        while len(candidate.asPolygon()[0]) > max_vertices and tolerance < diagonal:
+            candidate = polygon.buffer(tolerance, 2).simplify(tolerance)
+            if candidate.isEmpty() or candidate.isMultipart():
+                candidate = polygon.convexHull().buffer(tolerance, 2).simplify(
+                    tolerance
+                )
+            tolerance *= 2
+
+        ring = candidate.asPolygon()[0] if candidate.asPolygon() else []
+        if len(ring) < 4 or len(ring) > max_vertices:
+            ring = QgsGeometry.fromRect(rect).asPolygon()[0]
+
+        # Overpass closes the polygon itself
+        return [(point.x(), point.y()) for point in ring[:-1]]
+
+    def isIncomplete(self, content):
+        # The remark is the last member of the document
+        tail = content[-1024:].decode("utf-8", "ignore")
+        return '"remark"' in tail and ("runtime error" in tail or "timed out" in tail)
+
+    def isCacheable(self, content):
+        # Overpass answers timeouts and runtime errors with a partial result
+        # and a remark at the end of the document, those must not be cached.
+        return b'"remark"' not in content[-1024:]
+
+    def createOverpassQuery(
+        self, tags, x_min, y_min, x_max, y_max, poly_filters=None
+    ):
+        if poly_filters:
+            areas = [f'(poly:"{poly}")' for poly in poly_filters]
+        else:
+            areas = [f"({y_min},{x_min},{y_max},{x_max})"]
+        return overpass_query(tags, areas, self.geometry_mode)
 
     def getAttributeMappings(self):
         return {
@@ -162,35 +704,72 @@ class OverpassAPIQueryStrategy(APIQueryStrategy):
         return data.get("elements", [])
 
     def extractLatLon(self, element):
-        lat = element.get("lat")
-        lon = element.get("lon")
+        # "out center" puts the position of ways into a center member
+        location = element.get("center", element)
+        lat = location.get("lat")
+        lon = location.get("lon")
         if lon is not None and lat is not None:
-            lat, lon = self.transformCoordinates(lon, lat)
             return lat, lon
         else:
             return None, None
 
     def extractPolygonNodes(self, element):
-        nodes = element.get("nodes")
+        # restructure_data stores way geometries as flat coordinate arrays
+        coordinates = element.get("coordinates")
+        if coordinates is not None:
+            if len(coordinates) >= 4:
+                return list(zip(coordinates[0::2], coordinates[1::2]))
+            return None
+
+        if element["type"] == "relation":
+            return self.extractMultipolygonRings(element)
+
+        # "out geom" inlines the coordinates as geometry
+        nodes = element.get("geometry")
         if (
             nodes is not None and len(nodes) >= 2
         ):  # Make sure there are at least 3 nodes to form a polygon
-            coordinates = [(node["lon"], node["lat"]) for node in nodes]
-            transformed_coordinates = [
-                self.transformCoordinates(lat, lon) for lat, lon in coordinates
-            ]  # Switched lat and lon
-            transformed_points = [
-                QgsPointXY(lon, lat) for lat, lon in transformed_coordinates
-            ]  # Switched lon and lat
-            return transformed_points
+            return [(node["lon"], node["lat"]) for node in nodes]
         else:
             return None
 
+    def extractMultipolygonRings(self, element):
+        # restructure_data assembles the relations of "nodes" mode responses,
+        # "out geom" inlines the geometry of the member ways instead
+        polygons = element.get("polygons")
+        if polygons is None:
+            polygons = assemble_multipolygon(
+                (
+                    member["role"],
+                    array(
+                        "d",
+                        (
+                            value
+                            for node in member.get("geometry", [])
+                            if node is not None
+                            for value in (node["lon"], node["lat"])
+                        ),
+                    ),
+                )
+                for member in element.get("members", [])
+                if member["type"] == "way"
+            )
+        if not polygons:
+            return None
+        return [
+            [list(zip(ring[0::2], ring[1::2])) for ring in polygon]
+            for polygon in polygons
+        ]
+
     def getGeometryType(self, element):
         if element["type"] == "node":
             return "point"
+        elif element["type"] in ("way", "relation") and "center" in element:
+            return "point"
         elif element["type"] == "way":
             return "polygon"
+        elif element["type"] == "relation":
+            return "multipolygon"
         else:
             return "unknown"
 
@@ -198,9 +777,12 @@ class OverpassAPIQueryStrategy(APIQueryStrategy):
 class iDAIGazetteerAPIQueryStrategy(APIQueryStrategy):
     source = "iDAI.Gazetteer"
 
-    def query(self, x_min, y_min, x_max, y_max):
+    def query(
+        self, x_min, y_min, x_max, y_max, feedback=None, survey_features=None
+    ):
         x_min, y_min = self.transformTo4326(x_min, y_min)
         x_max, y_max = self.transformTo4326(x_max, y_max)
+        x_min, y_min, x_max, y_max = self.roundBBox(x_min, y_min, x_max, y_max)
 
         idai_gazetteer_filter = QgsSettings().value("/KgrFinder/idai_gazetteer_filter", "None")
         custom_gazetteer_tags = QgsSettings().value("/KgrFinder/custom_gazetteer_tags", [])
@@ -229,34 +811,69 @@ class iDAIGazetteerAPIQueryStrategy(APIQueryStrategy):
         q_string += f'{x_min}&polygonFilterCoordinates={y_min}&polygonFilterCoordinates={x_max}+'
         q_string += f'&polygonFilterCoordinates={y_min}&polygonFilterCoordinates={x_max}&polygonFilterCoordinates={y_max}'
         q_string += f'&polygonFilterCoordinates={x_min}&polygonFilterCoordinates={y_max}'
-        q_string += "&limit=1000&type=extended&pretty=true"
+        q_string += "&type=extended&pretty=true"
         url = url + q_string
-        
-        request = QNetworkRequest(QUrl(url))
-        Log.log_debug(f"called url {url}")
-        reply = QgsNetworkAccessManager.instance().blockingGet(request)
 
-        if reply.error():
-            if reply.errorString():
-                Log.log_debug(reply.errorString())
-                iface.messageBar().pushMessage(
-                    "KGR", reply.errorString(), level=Qgis.Critical, duration=3
-                )
+        page_size = QgsSettings().value("/KgrFinder/idai_page_size", 1000, type=int)
+        cache_parts = dict(
+            source=self.source,
+            filter=idai_gazetteer_filter,
+            tags=sorted(set(custom_gazetteer_tags)),
+            bbox=[x_min, y_min, x_max, y_max],
+            limit=page_size,
+        )
+
+        def fetchPage(offset, page_feedback):
+            page_url = f"{url}&limit={page_size}&offset={offset}"
+            cache_key = ResponseCache.makeKey(offset=offset, **cache_parts)
+            content = self.fetch(page_url, cache_key, page_feedback)
+            if content:
+                return json.loads(content)
+            return None
 
-        if reply.content():
-            data = str(reply.content(), "utf-8")
-            data = json.loads(data)
-            new_data = copy.deepcopy(data)
-            return new_data
+        first_page = fetchPage(0, feedback)
+        if not first_page:
+            return None
 
-        return None
+        total = first_page.get("total", 0)
+        offsets = range(page_size, total, page_size)
+        Log.log_debug(f"{total} results, fetching {len(offsets)} more pages")
+
+        return {
+            "total": total,
+            "result": self.iterPages(first_page, fetchPage, offsets, feedback),
+        }
+
+    def iterPages(self, first_page, fetchPage, offsets, feedback=None):
+        """Yield the results of all pages, the remaining pages are fetched
+        concurrently and streamed in the order they arrive."""
+        yield from first_page.get("result", [])
+
+        parallel_requests = QgsSettings().value(
+            "/KgrFinder/idai_parallel_requests", 4, type=int
+        )
+        executor = ConcurrentExecutor(max_workers=parallel_requests, feedback=feedback)
+        for offset, page, error in executor.run(fetchPage, offsets):
+            if error is not None:
+                self.last_error = str(error)
+                self.incomplete = True
+                Log.log_error(f"page at offset {offset} failed: {error!r}")
+                continue
+            if page:
+                yield from page.get("result", [])
+
+    def expectedElementCount(self, data):
+        if not data:
+            return 0
+        return data.get("total", 0)
 
     def getAttributeMappings(self):
         return {
             'name': 'prefName.title',
             # 'description': 'types',
             'type': 'types',
-            "id": "@id",
+            # Numeric part of the "@id" URL
+            "id": "gazId",
             # 'tags': 'tags',
             "lat": "prefLocation.coordinates[1]",
             "lon": "prefLocation.coordinates[0]",
@@ -289,13 +906,7 @@ class iDAIGazetteerAPIQueryStrategy(APIQueryStrategy):
             coordinates = recursive_extract_coordinates(shape)
 
             if coordinates:
-                transformed_coordinates = [
-                    self.transformCoordinates(lon, lat) for lon, lat in coordinates
-                ]
-                transformed_points = [
-                    QgsPointXY(lon, lat) for lat, lon in transformed_coordinates
-                ]
-                return transformed_points
+                return coordinates
 
         return None
 
@@ -306,7 +917,6 @@ class iDAIGazetteerAPIQueryStrategy(APIQueryStrategy):
         if len(coordinates) == 2:
             lat = coordinates[1]
             lon = coordinates[0]
-            lat, lon = self.transformCoordinates(lon, lat)
             return lat, lon
         else:
             return None, None
@@ -0,0 +1,74 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from qgis.core import QgsFeedback
+
+
+class ConcurrentExecutor:
+    """Runs jobs on a thread pool and yields their results as they finish.
+
+    Every job gets its own QgsFeedback, so a job that exceeds ``timeout``
+    seconds (measured from the moment it starts) can have its network
+    requests aborted without affecting the others. Canceling the parent
+    ``feedback`` cancels all jobs.
+    """
+
+    poll_interval = 0.2
+
+    def __init__(self, max_workers=4, timeout=None, feedback=None):
+        self.max_workers = max(1, int(max_workers))
+        self.timeout = timeout if timeout and timeout > 0 else None
+        self.feedback = feedback
+
+    def run(self, function, items):
+        """Call ``function(item, feedback)`` for every item.
+
+        Yields ``(item, result, error)`` tuples in completion order, where
+        ``error`` is the raised exception or a TimeoutError.
+        """
+        items = list(items)
+        if not items:
+            return
+
+        feedbacks = [QgsFeedback() for _ in items]
+        started = {}
+
+        def job(index):
+            started[index] = time.monotonic()
+            return function(items[index], feedbacks[index])
+
+        pool = ThreadPoolExecutor(max_workers=min(self.max_workers, len(items)))
+        futures = {pool.submit(job, index): index for index in range(len(items))}
+        pending = set(futures)
+
+        try:
+            while pending:
+                done, pending = wait(
+                    pending, timeout=self.poll_interval, return_when=FIRST_COMPLETED
+                )
+
+                for future in done:
+                    index = futures[future]
+                    try:
+                        yield items[index], future.result(), None
+                    except Exception as e:
+                        yield items[index], None, e
+
+                if self.feedback is not None and self.feedback.isCanceled():
+                    break
+
+                if self.timeout is not None:
+                    now = time.monotonic()
+                    for future in list(pending):
+                        index = futures[future]
+                        if index in started and now - started[index] > self.timeout:
+                            feedbacks[index].cancel()
+                            pending.discard(future)
+                            yield items[index], None, TimeoutError(
+                                f"timed out after {self.timeout:g} s"
+                            )
+        finally:
+            for future in pending:
+                future.cancel()
+                feedbacks[futures[future]].cancel()
+            pool.shutdown(wait=False)
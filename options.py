@@ -10,6 +10,7 @@ from qgis.PyQt.QtWidgets import (
     QFormLayout,
     QLabel,
     QRadioButton,
+    QSpinBox,
     QTextEdit,
     QVBoxLayout,
 )
@@ -55,10 +56,32 @@ class ConfigOptionsPage(QgsOptionsPageWidget):
 
     settings_tags = ["OSM abfragen", "iDAI abfragen"]
 
+    overpass_geometry_mode = ["nodes", "geom", "center"]
+
+    query_options = [
+        "Filter OSM by survey polygons",
+        "Store results in EPSG:4326",
+        "Show results while loading",
+        "Append to existing KGR layers",
+        "Store results in a GeoPackage",
+    ]
+
+    # (settings key, label, default, minimum, maximum)
+    performance_settings = [
+        ("cache_ttl_hours", "Cache lifetime (hours)", 168, 0, 8760),
+        ("cache_max_size_mb", "Cache size limit (MB)", 256, 1, 10000),
+        ("tile_zoom", "OSM tile zoom level", 12, 1, 18),
+        ("max_tiles", "Max. OSM tiles per query", 64, 1, 1024),
+        ("overpass_parallel_requests", "Parallel OSM requests", 2, 1, 8),
+        ("idai_page_size", "iDAI results per page", 1000, 10, 10000),
+        ("idai_parallel_requests", "Parallel iDAI requests", 4, 1, 16),
+    ]
+
     initially_checked = {
         "osm_tags": ["heritage", "historic"],
         "settings_tags": ["iDAI abfragen", "OSM abfragen"],
         "idai_gazetteer_filter": "archaeological-site",
+        "overpass_geometry_mode": "nodes",
     }
 
     labels = {
@@ -67,6 +90,10 @@ class ConfigOptionsPage(QgsOptionsPageWidget):
         "osm_custom_tags_textarea": "Custom OSM Tags that should be respected (each on one line)",
         "idai_gazetteer_filter": "Please choose the location type that is used for a iDAI.gazetteer search",
         "idai_gazetteer_tags_tagarea": "Tags that should filter the result (each on one line). Tags act with AND operator.",
+        "query_options": "Options for how data is queried and stored",
+        "performance_settings": "Response cache, tiling and request limits",
+        "tag_columns_textarea": "OSM tag keys stored in columns of their own, e.g. historic (each on one line)",
+        "overpass_geometry_mode": "How OSM way geometries are fetched: nodes (resolved by the plugin), geom (inline, smaller responses) or center (points only, fastest overview)",
     }
 
     def __init__(self, parent):
@@ -82,10 +109,19 @@ class ConfigOptionsPage(QgsOptionsPageWidget):
         self.section_checkboxes = {}
         self.text_areas = {}
         self.section_radio_buttons = {}
+        self.number_inputs = {}
 
         group_box_layout_settings = self.createCheckBoxes(
             layout, "Settings", self.settings_tags, "settings_tags"
         )
+        group_box_layout_query = self.createCheckBoxes(
+            layout, "Query Options", self.query_options, "query_options"
+        )
+        self.createTextarea(
+            group_box_layout_query,
+            "tag_columns",
+            self.labels["tag_columns_textarea"],
+        )
         group_box_layout_osm = self.createCheckBoxes(
             layout, "OSM – Cultural Tags", self.osm_tags, "osm_tags"
         )
@@ -94,6 +130,12 @@ class ConfigOptionsPage(QgsOptionsPageWidget):
             "custom_osm_tags",
             self.labels["osm_custom_tags_textarea"],
         )
+        self.createRadioButtons(
+            layout,
+            "OSM – Geometry Mode",
+            self.overpass_geometry_mode,
+            "overpass_geometry_mode",
+        )
         group_box_layout_gazetteer = self.createRadioButtons(
             layout,
             "IDAI Gazetteer Filter",
@@ -105,6 +147,9 @@ class ConfigOptionsPage(QgsOptionsPageWidget):
             "custom_gazetteer_tags",
             self.labels["idai_gazetteer_tags_tagarea"],
         )
+        self.createNumberInputs(
+            layout, "Performance", self.performance_settings, "performance_settings"
+        )
 
         self.applyInitialSettings()
         self.loadAndSetCheckboxes()
@@ -164,6 +209,35 @@ class ConfigOptionsPage(QgsOptionsPageWidget):
 
         self.text_areas[key] = textarea
 
+    def createNumberInputs(self, layout, group_title, settings, settings_key):
+        group_box = QgsCollapsibleGroupBox(group_title)
+        group_box.setCollapsed(True)
+        group_box_layout = QFormLayout()
+        group_box.setLayout(group_box_layout)
+
+        # Add an informational label
+        info_label = QLabel(self.labels[settings_key])
+        group_box_layout.addRow(info_label)
+
+        self.cache_checkbox = QCheckBox("Cache responses")
+        self.cache_checkbox.setChecked(
+            QgsSettings().value("/KgrFinder/cache_enabled", True, type=bool)
+        )
+        group_box_layout.addRow(self.cache_checkbox)
+
+        for key, label, default, minimum, maximum in settings:
+            spin_box = QSpinBox()
+            spin_box.setRange(minimum, maximum)
+            spin_box.setValue(
+                QgsSettings().value(f"/KgrFinder/{key}", default, type=int)
+            )
+            group_box_layout.addRow(label, spin_box)
+            self.number_inputs[key] = spin_box
+
+        layout.addWidget(group_box)
+
+        return group_box_layout
+
     def createRadioButtons(self, layout, group_title, tags, settings_key):
         group_box = QgsCollapsibleGroupBox(group_title)
         group_box.setCollapsed(True)
@@ -233,6 +307,15 @@ class ConfigOptionsPage(QgsOptionsPageWidget):
             f"/KgrFinder/custom_gazetteer_tags",
             self.text_areas["custom_gazetteer_tags"].toPlainText().splitlines(),
         )
+        QgsSettings().setValue(
+            f"/KgrFinder/tag_columns",
+            self.text_areas["tag_columns"].toPlainText().splitlines(),
+        )
+        QgsSettings().setValue(
+            "/KgrFinder/cache_enabled", self.cache_checkbox.isChecked()
+        )
+        for key, spin_box in self.number_inputs.items():
+            QgsSettings().setValue(f"/KgrFinder/{key}", spin_box.value())
 
     def loadAndSetCheckboxes(self):
         for settings_key, checkboxes in self.section_checkboxes.items():
@@ -249,6 +332,11 @@ class ConfigOptionsPage(QgsOptionsPageWidget):
         self.text_areas["custom_gazetteer_tags"].setPlainText(
             "\n".join(custom_gazetteer_tags)
         )
+        tag_columns = QgsSettings().value(f"/KgrFinder/tag_columns", [])
+        # QSettings returns a list with a single entry as a plain string
+        if isinstance(tag_columns, str):
+            tag_columns = [tag_columns]
+        self.text_areas["tag_columns"].setPlainText("\n".join(tag_columns))
 
     def checkboxStateChanged(self):
         for settings_key, checkboxes in self.section_checkboxes.items():
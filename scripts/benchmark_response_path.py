@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""Benchmark the Overpass response path on a synthetic fixture.
+
+Compares the former path (decode to str, json.loads, copy.deepcopy and the
+list based restructuring) with the streaming path used by
+OverpassAPIQueryStrategy. Run from the plugin directory:
+
+    python3 scripts/benchmark_response_path.py [element count]
+"""
+import copy
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from utils.json_stream import JSONArrayStream, iter_chunks  # noqa: E402
+from utils.overpass import restructure_elements  # noqa: E402
+
+
+def build_fixture(count, nodes_per_way=8):
+    """Return an Overpass style response with ``count`` elements in total,
+    a tenth of them tagged nodes and the rest ways with their member nodes."""
+    random.seed(1)
+    elements = []
+    node_id = 1
+    way_id = 1
+    ways = []
+    while len(elements) + len(ways) < count:
+        if len(elements) % 10 == 0:
+            elements.append(
+                {
+                    "type": "node",
+                    "id": node_id,
+                    "lat": 52 + random.random(),
+                    "lon": 13 + random.random(),
+                    "tags": {"historic": "memorial", "name": f"Memorial {node_id}"},
+                }
+            )
+            node_id += 1
+            continue
+
+        member_ids = []
+        for _ in range(nodes_per_way - 1):
+            elements.append(
+                {
+                    "type": "node",
+                    "id": node_id,
+                    "lat": 52 + random.random(),
+                    "lon": 13 + random.random(),
+                }
+            )
+            member_ids.append(node_id)
+            node_id += 1
+        ways.append(
+            {
+                "type": "way",
+                "id": way_id,
+                "nodes": member_ids + member_ids[:1],
+                "tags": {"historic": "archaeological_site"},
+            }
+        )
+        way_id += 1
+
+    document = {"version": 0.6, "generator": "fixture", "elements": elements + ways}
+    return json.dumps(document).encode("utf-8")
+
+
+def legacy_path(content):
+    data = str(content, "utf-8")
+    data = json.loads(data)
+    new_data = copy.deepcopy(data)
+
+    nodes = {
+        element["id"]: (element["lat"], element["lon"])
+        for element in new_data["elements"]
+        if element["type"] == "node"
+    }
+    ways = {
+        element["id"]: element
+        for element in new_data["elements"]
+        if element["type"] == "way"
+    }
+    possible_node_ids = set()
+    for way_id, node_ids in ways.items():
+        possible_node_ids.update(node_ids["nodes"])
+    new_data["elements"] = [
+        element
+        for element in new_data["elements"]
+        if element["type"] != "node" or element["id"] not in possible_node_ids
+    ]
+    for way_id, node_ids in ways.items():
+        ways[way_id]["nodes"] = [
+            {"lon": nodes[node_id][1], "lat": nodes[node_id][0]}
+            for node_id in node_ids["nodes"]
+            if node_id in nodes
+        ]
+
+    return sum(1 for _ in new_data["elements"])
+
+
+def streaming_path(content):
+    elements = JSONArrayStream(iter_chunks(content), "elements")
+    return sum(1 for _ in restructure_elements(elements, ["historic"]))
+
+
+def measure(function, content):
+    # tracemalloc slows down allocations, so time and memory are measured
+    # in separate runs
+    start = time.perf_counter()
+    count = function(content)
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    function(content)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return count, elapsed, peak
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    content = build_fixture(count)
+    print(f"fixture: {count} elements, {len(content) / 2**20:.1f} MiB")
+
+    results = {}
+    for name, function in (("legacy", legacy_path), ("streaming", streaming_path)):
+        results[name] = measure(function, content)
+        features, elapsed, peak = results[name]
+        print(
+            f"{name:>10}: {elapsed:6.2f} s, peak {peak / 2**20:7.1f} MiB, "
+            f"{features} features"
+        )
+
+    legacy, streaming = results["legacy"], results["streaming"]
+    print(
+        f"     saved: {legacy[1] - streaming[1]:6.2f} s, "
+        f"peak {(legacy[2] - streaming[2]) / 2**20:7.1f} MiB"
+    )
+
+
+if __name__ == "__main__":
+    main()
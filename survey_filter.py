@@ -0,0 +1,41 @@
+from qgis.core import QgsGeometry, QgsSpatialIndex
+
+
+class SurveyAreaFilter:
+    """Tests fetched geometries against the survey polygons.
+
+    The bounding boxes of the survey polygons go into a QgsSpatialIndex, so
+    a geometry is only tested against the polygons its bounding box hits,
+    with geometry engines prepared once per polygon. Prepared engines are
+    not safe to share between threads, create one filter per worker.
+    """
+
+    def __init__(self, features):
+        self.index = QgsSpatialIndex()
+        self.polygons = {}
+        for number, feature in enumerate(features):
+            geometry = feature.geometry()
+            if geometry.isEmpty():
+                continue
+            engine = QgsGeometry.createGeometryEngine(geometry.constGet())
+            engine.prepareGeometry()
+            # The engine refers to the geometry, keep it alive as well
+            self.polygons[number] = (geometry, engine)
+            self.index.addFeature(number, geometry.boundingBox())
+
+    def accepts(self, geometry, geometry_type):
+        """Return whether a point lies within or another geometry intersects
+        any of the survey polygons."""
+        if not self.polygons:
+            return False
+
+        candidates = self.index.intersects(geometry.boundingBox())
+        shape = geometry.constGet()
+        for number in candidates:
+            engine = self.polygons[number][1]
+            if geometry_type == "point":
+                if engine.contains(shape):
+                    return True
+            elif engine.intersects(shape):
+                return True
+        return False
@@ -0,0 +1,263 @@
+import threading
+import time
+
+from qgis.core import Qgis, QgsFeature, QgsFeedback, QgsProject, QgsSettings, QgsTask
+from qgis.PyQt.QtCore import pyqtSignal
+from qgis.utils import iface
+
+from .data_apis import PROJECT_CRS, APIQueryStrategy
+from .exceptions import StopProcessingException
+from .executor import ConcurrentExecutor
+from .utils.features import hashable_value
+from .utils.logger import Logger
+
+Log = Logger()
+
+
+class KgrQueryTask(QgsTask):
+    """Fetches, parses and builds the KGR features in the background.
+
+    Everything up to the finished QgsFeature objects runs in ``run`` on a
+    worker thread. ``areas`` are ``(extent, survey features)`` pairs, one
+    per cluster of survey polygons. Every strategy queries every area, with
+    up to ``/KgrFinder/parallel_extents`` areas per strategy at once, and
+    builds its features as the response streams in, limited by the
+    ``/KgrFinder/source_timeout`` setting (seconds). Features found in
+    several areas are kept once. Only ``finished``, which QGIS calls on the
+    main thread, touches the result layers and the message bar.
+
+    With the "Show results while loading" query option the features of
+    every chunk are sent to the main thread through ``featuresReady`` and
+    committed right away, repainting the layers at most every
+    ``/KgrFinder/repaint_interval_ms`` milliseconds.
+    """
+
+    # Point and polygon features of one chunk, delivered on the main thread
+    featuresReady = pyqtSignal(list, list)
+
+    def __init__(self, tool, areas, fields, point_layer, polygon_layer):
+        super().__init__("KGR: querying data sources", QgsTask.CanCancel)
+        self.tool = tool
+        self.strategies = list(tool.api_strategies)
+        for strategy in self.strategies:
+            strategy.resetStatus()
+        self.areas = [(extent, list(features)) for extent, features in areas]
+        self.survey_features = [
+            feature for _, features in self.areas for feature in features
+        ]
+        self.destination_crs, self.filter_features = self.prepareLayerCrs(
+            point_layer
+        )
+        self.fields = fields
+        self.point_layer = point_layer
+        self.polygon_layer = polygon_layer
+        self.feedback = QgsFeedback()
+        self.source_timeout = QgsSettings().value(
+            "/KgrFinder/source_timeout", 600, type=int
+        )
+        self.parallel_extents = QgsSettings().value(
+            "/KgrFinder/parallel_extents", 2, type=int
+        )
+        self.progressive = "Show results while loading" in QgsSettings().value(
+            "/KgrFinder/query_options", []
+        )
+        self.repaint_interval = (
+            QgsSettings().value("/KgrFinder/repaint_interval_ms", 1000, type=int)
+            / 1000
+        )
+        self.last_repaint = 0
+        self.featuresReady.connect(self.commitChunk)
+        # strategy -> [points, polygons, element count]
+        self.results = {}
+        self.seen = {}
+        # Chunks of several areas are merged from their worker threads
+        self.lock = threading.Lock()
+        self.progress = {}
+        self.exception = None
+
+    def run(self):
+        try:
+            # One executor per strategy, so a slow source does not hold up
+            # the areas of the others
+            executor = ConcurrentExecutor(
+                max_workers=len(self.strategies), feedback=self.feedback
+            )
+            sources = executor.run(self.processStrategy, self.strategies)
+
+            for strategy, _, error in sources:
+                self.checkCanceled()
+                if error is not None:
+                    strategy.last_error = strategy.last_error or str(error)
+                    strategy.incomplete = True
+                    Log.log_error(f"{strategy.source} failed: {error!r}")
+
+            self.checkCanceled()
+            self.setProgress(100)
+            return True
+        except StopProcessingException:
+            return False
+        except Exception as e:
+            self.exception = e
+            return False
+
+    def processStrategy(self, strategy, feedback):
+        """Query every area for one strategy, up to ``parallel_extents`` at
+        once, and merge the features of each area as it finishes."""
+        executor = ConcurrentExecutor(
+            max_workers=self.parallel_extents,
+            timeout=self.source_timeout,
+            feedback=feedback,
+        )
+        jobs = [(strategy, extent, features) for extent, features in self.areas]
+
+        for (_, extent, _), result, error in executor.run(self.processArea, jobs):
+            if feedback.isCanceled():
+                raise StopProcessingException()
+            if error is not None:
+                strategy.last_error = strategy.last_error or str(error)
+                strategy.incomplete = True
+                Log.log_error(f"{strategy.source} failed for {extent}: {error!r}")
+                result = ([], [], 0)
+
+            self.mergeResult(strategy, *result)
+
+    def processArea(self, job, feedback):
+        """Query one strategy for one area and build its features.
+
+        Responses are streamed, so fetching and decoding continue while the
+        features are built. Both are covered by the source timeout.
+        """
+        strategy, extent, features = job
+        data = strategy.query(*extent, feedback=feedback, survey_features=features)
+        jobs = len(self.strategies) * len(self.areas)
+
+        def onProgress(fraction):
+            if feedback.isCanceled():
+                raise StopProcessingException()
+            self.progress[(strategy, extent)] = fraction
+            self.setProgress(100 * sum(self.progress.values()) / jobs)
+
+        def publish(points, polygons):
+            points, polygons = self.mergeResult(strategy, points, polygons, 0)
+            if points or polygons:
+                self.featuresReady.emit(points, polygons)
+
+        return self.tool.buildFeatures(
+            strategy,
+            data,
+            self.fields,
+            self.filter_features,
+            onProgress,
+            self.destination_crs,
+            publish if self.progressive else None,
+        )
+
+    def mergeResult(self, strategy, points, polygons, count):
+        """Add the features of one area to the results of a strategy, skipping
+        features already found in another area.
+
+        Returns the new point and polygon features. In progressive mode they
+        are committed by the caller and not kept in the results.
+        """
+        with self.lock:
+            if strategy not in self.results:
+                self.results[strategy] = [[], [], 0]
+                self.seen[strategy] = set()
+            result = self.results[strategy]
+            seen = self.seen[strategy]
+            result[2] += count
+
+            added = ([], [])
+            for features, new in zip((points, polygons), added):
+                if len(self.areas) == 1:
+                    new.extend(features)
+                    continue
+                for feature in features:
+                    # OSM ids are only unique per element type
+                    key = (
+                        hashable_value(feature["type"]),
+                        hashable_value(feature["id"]),
+                    )
+                    if key not in seen:
+                        seen.add(key)
+                        new.append(feature)
+
+            if not self.progressive:
+                result[0].extend(added[0])
+                result[1].extend(added[1])
+        return added
+
+    def commitChunk(self, points, polygons):
+        self.tool.commitFeatures(
+            self.point_layer, self.polygon_layer, points, polygons
+        )
+        now = time.monotonic()
+        if now - self.last_repaint >= self.repaint_interval:
+            self.last_repaint = now
+            self.tool.updateLayers(self.point_layer, self.polygon_layer)
+
+    def prepareLayerCrs(self, layer):
+        """Return the CRS features are built in and the survey features to
+        filter them with.
+
+        Layers in the project CRS need no transformation. For layers in
+        another CRS, such as EPSG:4326, the survey polygons are transformed
+        once each instead of reprojecting every fetched coordinate.
+        """
+        project_crs = QgsProject.instance().crs()
+        if layer.crs() == project_crs or not layer.crs().authid():
+            return PROJECT_CRS, self.survey_features
+
+        destination = layer.crs().authid()
+        transform = APIQueryStrategy.cachedTransform(PROJECT_CRS, destination)
+        features = []
+        for feature in self.survey_features:
+            feature = QgsFeature(feature)
+            geometry = feature.geometry()
+            geometry.transform(transform)
+            feature.setGeometry(geometry)
+            features.append(feature)
+        return destination, features
+
+    def checkCanceled(self):
+        if self.isCanceled():
+            raise StopProcessingException()
+
+    def cancel(self):
+        self.feedback.cancel()
+        super().cancel()
+
+    def finished(self, result):
+        if self.progressive:
+            # Show the chunks committed before a failure or cancellation too
+            self.tool.updateLayers(self.point_layer, self.polygon_layer)
+
+        if self.exception is not None:
+            Log.log_error(f"query task failed: {self.exception!r}")
+            iface.messageBar().pushMessage(
+                "KGR",
+                f"Query failed: {self.exception}",
+                level=Qgis.Critical,
+                duration=5,
+            )
+            return
+
+        if not result:
+            iface.messageBar().pushMessage(
+                "KGR", "Query canceled", level=Qgis.Info, duration=3
+            )
+            return
+
+        # Repaint the canvas once after all layers are loaded
+        canvas = iface.mapCanvas()
+        canvas.freeze(True)
+        try:
+            for strategy, (points, polygons, count) in self.results.items():
+                self.tool.commitFeatures(
+                    self.point_layer, self.polygon_layer, points, polygons
+                )
+                self.tool.reportStrategyResult(strategy, count)
+            self.tool.updateLayers(self.point_layer, self.polygon_layer)
+        finally:
+            canvas.freeze(False)
+        canvas.refresh()
@@ -0,0 +1,112 @@
+# coding=utf-8
+"""Response cache test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'toni.schoenbuchner@cuprit.net'
+__date__ = '2023-09-11'
+__copyright__ = 'Copyright 2023, cuprit gbr'
+
+import importlib
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+from utilities import get_qgis_app
+
+QGIS_APP = get_qgis_app()
+
+# cache.py uses relative imports, so load it as part of the plugin package
+PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(PLUGIN_DIR))
+cache = importlib.import_module(os.path.basename(PLUGIN_DIR) + ".cache")
+
+
+class ResponseCacheTest(unittest.TestCase):
+    """Test cached responses expire and are evicted."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.directory = tempfile.mkdtemp()
+        self.now = 1000.0
+        patcher = mock.patch.object(cache.time, "time", lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        """Runs after each test."""
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def make_cache(self, ttl=60, max_size=1024 * 1024):
+        path = os.path.join(self.directory, "responses.sqlite")
+        return cache.ResponseCache(path, ttl, max_size)
+
+    def test_roundtrip(self):
+        """Test responses are stored and keys are stable."""
+        response_cache = self.make_cache()
+        key = cache.ResponseCache.makeKey(url="https://example.org", query="a")
+        self.assertEqual(
+            key, cache.ResponseCache.makeKey(query="a", url="https://example.org")
+        )
+        self.assertIsNone(response_cache.get(key))
+        response_cache.put(key, b'{"elements": []}')
+        self.assertEqual(response_cache.get(key), b'{"elements": []}')
+        response_cache.clear()
+        self.assertIsNone(response_cache.get(key))
+
+    def test_ttl(self):
+        """Test expired entries miss unless explicitly allowed."""
+        response_cache = self.make_cache(ttl=60)
+        response_cache.put("key", b"data")
+        self.now += 60
+        self.assertEqual(response_cache.get("key"), b"data")
+        self.now += 1
+        self.assertIsNone(response_cache.get("key"))
+        self.assertEqual(response_cache.get("key", allow_expired=True), b"data")
+
+        # Storing again refreshes the entry
+        response_cache.put("key", b"new")
+        self.assertEqual(response_cache.get("key"), b"new")
+
+    def test_no_ttl(self):
+        """Test a ttl of 0 never expires entries."""
+        response_cache = self.make_cache(ttl=0)
+        response_cache.put("key", b"data")
+        self.now += 10**9
+        self.assertEqual(response_cache.get("key"), b"data")
+
+    def test_eviction(self):
+        """Test the least recently used entries are evicted first."""
+        content = os.urandom(400)  # incompressible
+        response_cache = self.make_cache(max_size=1000)
+        response_cache.put("a", content)
+        self.now += 1
+        response_cache.put("b", content)
+        self.now += 1
+        self.assertEqual(response_cache.get("a"), content)
+        self.now += 1
+        response_cache.put("c", content)
+
+        self.assertIsNone(response_cache.get("b"))
+        self.assertEqual(response_cache.get("a"), content)
+        self.assertEqual(response_cache.get("c"), content)
+
+    def test_oversized(self):
+        """Test an entry larger than the cap is not kept."""
+        response_cache = self.make_cache(max_size=100)
+        response_cache.put("big", os.urandom(400))
+        self.assertIsNone(response_cache.get("big"))
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(ResponseCacheTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,51 @@
+# coding=utf-8
+"""Survey polygon clustering test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'toni.schoenbuchner@cuprit.net'
+__date__ = '2023-09-11'
+__copyright__ = 'Copyright 2023, cuprit gbr'
+
+import unittest
+
+from utils.clusters import cluster_boxes
+
+
+class ClusterBoxesTest(unittest.TestCase):
+    """Test nearby boxes are grouped."""
+
+    def test_scattered_sites(self):
+        """Test distant groups of boxes become separate clusters."""
+        boxes = [
+            (0, 0, 1, 1),
+            (80, 0, 81, 1),
+            (1.5, 0.5, 2, 2),
+            (81, 3, 82, 4),
+        ]
+        clusters = sorted(cluster_boxes(boxes, 2))
+        self.assertEqual(
+            clusters,
+            [((0, 0, 2, 2), [0, 2]), ((80, 0, 82, 4), [1, 3])],
+        )
+
+    def test_chained_boxes(self):
+        """Test boxes joined through a chain of neighbours."""
+        boxes = [(x, 0, x + 1, 1) for x in range(0, 30, 2)]
+        self.assertEqual(len(cluster_boxes(boxes, 1)), 1)
+        self.assertEqual(len(cluster_boxes(boxes, 0.5)), len(boxes))
+
+    def test_no_boxes(self):
+        """Test an empty input gives no clusters."""
+        self.assertEqual(cluster_boxes([], 1), [])
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(ClusterBoxesTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
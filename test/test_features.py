@@ -0,0 +1,57 @@
+# coding=utf-8
+"""Feature signature test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'toni.schoenbuchner@cuprit.net'
+__date__ = '2023-09-11'
+__copyright__ = 'Copyright 2023, cuprit gbr'
+
+import unittest
+
+from utils.features import feature_signature, hashable_value
+
+
+class Null:
+    """Stands in for the unhashable NULL QVariant of PyQt."""
+
+    __hash__ = None
+
+    def isNull(self):
+        return True
+
+
+class FeatureSignatureTest(unittest.TestCase):
+    """Test signatures of features with NULL and map attributes."""
+
+    def test_null_attributes(self):
+        """Test NULL attributes hash like None."""
+        self.assertIsNone(hashable_value(Null()))
+        self.assertEqual(
+            feature_signature(["iDAI.Gazetteer", Null(), 1.5, Null()], b"\x01"),
+            feature_signature(["iDAI.Gazetteer", None, 1.5, None], b"\x01"),
+        )
+
+    def test_map_attributes(self):
+        """Test tag maps hash independent of their order."""
+        self.assertEqual(
+            feature_signature([{"a": "1", "b": Null()}], b""),
+            feature_signature([{"b": None, "a": "1"}], b""),
+        )
+
+    def test_changes(self):
+        """Test changed attributes or geometries change the signature."""
+        signature = feature_signature(["x", 1], b"\x01")
+        self.assertNotEqual(signature, feature_signature(["y", 1], b"\x01"))
+        self.assertNotEqual(signature, feature_signature(["x", 1], b"\x02"))
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(FeatureSignatureTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,72 @@
+# coding=utf-8
+"""Streaming JSON decoder test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'toni.schoenbuchner@cuprit.net'
+__date__ = '2023-09-11'
+__copyright__ = 'Copyright 2023, cuprit gbr'
+
+import json
+import unittest
+
+from utils.json_stream import JSONArrayStream, iter_chunks
+
+
+class JSONArrayStreamTest(unittest.TestCase):
+    """Test elements are decoded incrementally."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.document = {
+            "version": 0.6,
+            "osm3s": {"copyright": "OpenStreetMap contributors"},
+            "elements": [
+                {
+                    "type": "node",
+                    "id": index,
+                    "lat": 52.5 + index * 1e-7,
+                    "lon": -13.4,
+                    "tags": {"name": f"Grabhügel {index}"},
+                }
+                for index in range(200)
+            ],
+            "remark": "runtime error: Query timed out",
+        }
+        self.content = json.dumps(
+            self.document, ensure_ascii=False, indent=1
+        ).encode("utf-8")
+
+    def test_items_for_any_chunk_size(self):
+        """Test items and extras survive chunk boundaries."""
+        for chunk_size in (1, 3, 64, 1 << 16):
+            stream = JSONArrayStream(
+                iter_chunks(self.content, chunk_size), "elements"
+            )
+            self.assertEqual(list(stream), self.document["elements"])
+            self.assertEqual(stream.extras["version"], 0.6)
+            self.assertEqual(stream.extras["remark"], self.document["remark"])
+
+    def test_missing_and_empty_array(self):
+        """Test documents without items yield nothing."""
+        self.assertEqual(list(JSONArrayStream([b"{}"], "elements")), [])
+        self.assertEqual(
+            list(JSONArrayStream([b'{"elements": [ ]}'], "elements")), []
+        )
+
+    def test_truncated_document(self):
+        """Test a truncated document raises."""
+        stream = JSONArrayStream([self.content[:-40]], "elements")
+        with self.assertRaises(ValueError):
+            list(stream)
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(JSONArrayStreamTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
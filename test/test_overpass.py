@@ -0,0 +1,194 @@
+# coding=utf-8
+"""Overpass multipolygon assembly test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'toni.schoenbuchner@cuprit.net'
+__date__ = '2023-09-11'
+__copyright__ = 'Copyright 2023, cuprit gbr'
+
+import math
+import random
+import unittest
+from array import array
+
+from unittest import mock
+
+from utils import overpass
+from utils.overpass import (NodeIndex, assemble_multipolygon, overpass_query,
+                            restructure_elements, stitch_rings)
+
+
+def line(*points):
+    return array("d", [value for point in points for value in point])
+
+
+class MultipolygonAssemblyTest(unittest.TestCase):
+    """Test member ways are stitched into rings."""
+
+    def test_reversed_ways_are_joined(self):
+        """Test ways pointing in either direction form one ring."""
+        ways = [
+            line((0, 0), (10, 0)),
+            line((10, 10), (10, 0)),
+            line((10, 10), (0, 10)),
+            line((0, 10), (0, 0)),
+        ]
+        rings = stitch_rings(ways)
+        self.assertEqual(len(rings), 1)
+        self.assertEqual(len(rings[0]), 10)
+        self.assertEqual(rings[0][:2], rings[0][-2:])
+
+    def test_many_members(self):
+        """Test a ring split into thousands of shuffled ways."""
+        random.seed(1)
+        count = 20000
+        points = [
+            (math.cos(2 * math.pi * i / count), math.sin(2 * math.pi * i / count))
+            for i in range(count)
+        ]
+        points.append(points[0])
+        ways = [line(*points[i : i + 5]) for i in range(0, count, 4)]
+        random.shuffle(ways)
+        rings = stitch_rings(ways)
+        self.assertEqual(len(rings), 1)
+        self.assertEqual(len(rings[0]), 2 * (count + 1))
+
+    def test_unclosed_ways_are_dropped(self):
+        """Test ways that cannot be closed do not form a ring."""
+        self.assertEqual(stitch_rings([line((0, 0), (1, 0), (1, 1))]), [])
+
+    def test_inner_rings(self):
+        """Test inner rings are assigned to the outer ring containing them."""
+        polygons = assemble_multipolygon(
+            [
+                ("outer", line((0, 0), (10, 0), (10, 10), (0, 10), (0, 0))),
+                ("", line((20, 20), (21, 20), (21, 21), (20, 20))),
+                ("inner", line((2, 2), (3, 2), (3, 3))),
+                ("inner", line((3, 3), (2, 3), (2, 2))),
+                ("outer", None),
+            ]
+        )
+        self.assertEqual(sorted(len(polygon) for polygon in polygons), [1, 2])
+
+
+class NodeIndexTest(unittest.TestCase):
+    """Test node coordinates are looked up by id."""
+
+    def build(self, node_ids):
+        index = NodeIndex()
+        for node_id in node_ids:
+            index.add(node_id, node_id + 0.5, -node_id - 0.25)
+        return index
+
+    def check_lookups(self):
+        # Overpass sorts nodes by id, but ids need not be consecutive
+        index = self.build([3, 10, 11, 2**40])
+        coordinates = index.resolve([10, 7, 2**40, 3, 12])
+        self.assertEqual(
+            list(coordinates),
+            [10.5, -10.25, 2**40 + 0.5, -(2**40) - 0.25, 3.5, -3.25],
+        )
+        self.assertEqual(len(NodeIndex().resolve([1, 2])), 0)
+
+        # Unsorted input is sorted before the first lookup
+        index = self.build([5, 1, 4, 2])
+        self.assertEqual(list(index.resolve([4, 1])), [4.5, -4.25, 1.5, -1.25])
+        # Adding after a lookup keeps working
+        index.add(3, 3.5, -3.25)
+        self.assertEqual(list(index.resolve([3, 5])), [3.5, -3.25, 5.5, -5.25])
+
+    def test_bisect(self):
+        """Test lookups without NumPy."""
+        with mock.patch.object(overpass, "numpy", None):
+            self.check_lookups()
+
+    @unittest.skipIf(overpass.numpy is None, "NumPy is not installed")
+    def test_numpy(self):
+        """Test lookups with NumPy searchsorted."""
+        self.check_lookups()
+
+
+class RestructureElementsTest(unittest.TestCase):
+    """Test "out" responses are turned into the elements of the query."""
+
+    def test_ways(self):
+        """Test ways get their coordinates and only matching nodes are kept."""
+        elements = [
+            {"type": "node", "id": 1, "lat": 0.0, "lon": 0.0},
+            {"type": "node", "id": 2, "lat": 0.0, "lon": 1.0, "tags": {"a": "b"}},
+            {"type": "node", "id": 3, "lat": 1.0, "lon": 1.0},
+            {"type": "node", "id": 4, "lat": 5.0, "lon": 5.0, "tags": {"a": "c"}},
+            {"type": "way", "id": 9, "nodes": [1, 2, 3, 1], "tags": {"a": "d"}},
+        ]
+        result = list(restructure_elements(elements, ["a=c", "a=d"]))
+        self.assertEqual([element["id"] for element in result], [4, 9])
+        self.assertEqual(
+            list(result[1]["coordinates"]), [0.0, 0.0, 1.0, 0.0, 1.0, 1.0, 0.0, 0.0]
+        )
+
+    def castle(self):
+        # Elements are modified in place, every test gets fresh ones
+        return [
+            {"type": "node", "id": 1, "lat": 0.0, "lon": 0.0},
+            {"type": "node", "id": 2, "lat": 0.0, "lon": 1.0},
+            {"type": "node", "id": 3, "lat": 1.0, "lon": 1.0},
+            {"type": "node", "id": 4, "lat": 0.5, "lon": 0.5, "tags": {"place": "x"}},
+            {"type": "way", "id": 9, "nodes": [1, 2, 3, 1], "tags": {"building": "a"}},
+            {
+                "type": "relation",
+                "id": 20,
+                "members": [
+                    {"type": "way", "ref": 9, "role": "outer"},
+                    {"type": "node", "ref": 4, "role": "label"},
+                ],
+                "tags": {"type": "multipolygon", "historic": "castle"},
+            },
+        ]
+
+    def test_relation_members(self):
+        """Test recursed members with tags of their own are not returned."""
+        result = list(restructure_elements(self.castle(), ["historic"]))
+        self.assertEqual([element["id"] for element in result], [20])
+        self.assertEqual(len(result[0]["polygons"]), 1)
+
+    def test_matching_members(self):
+        """Test members matching the query themselves are returned."""
+        result = list(restructure_elements(self.castle(), ["historic", "building"]))
+        self.assertEqual([element["id"] for element in result], [9, 20])
+
+
+class OverpassQueryTest(unittest.TestCase):
+    """Test the generated Overpass QL."""
+
+    def test_recursion_per_area(self):
+        """Test ways and relations of every poly: filter are recursed."""
+        query = overpass_query(["historic"], ['(poly:"A")', '(poly:"B")'])
+        self.assertEqual(
+            query,
+            "[out:json];("
+            "node['historic'](poly:\"A\");way['historic'](poly:\"A\");>;"
+            "relation['historic']['type'='multipolygon'](poly:\"A\");>;"
+            "node['historic'](poly:\"B\");way['historic'](poly:\"B\");>;"
+            "relation['historic']['type'='multipolygon'](poly:\"B\");>;"
+            ");out;",
+        )
+
+    def test_inline_geometry_modes(self):
+        """Test "geom" and "center" need no recursion."""
+        for mode in ("geom", "center"):
+            query = overpass_query(["heritage=2"], ["(1,2,3,4)"], mode)
+            self.assertNotIn(">;", query)
+            self.assertIn("way['heritage'='2'](1,2,3,4);", query)
+            self.assertTrue(query.endswith(f");out {mode};"))
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(MultipolygonAssemblyTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,59 @@
+# coding=utf-8
+"""Tile grid test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'toni.schoenbuchner@cuprit.net'
+__date__ = '2023-09-11'
+__copyright__ = 'Copyright 2023, cuprit gbr'
+
+import unittest
+
+from utils.tiles import tile_bbox, tile_count, tiles_for_bbox
+
+
+class TileGridTest(unittest.TestCase):
+    """Test bboxes are covered by the fixed tile grid."""
+
+    def test_cover(self):
+        """Test the tiles cover the bbox and nothing more."""
+        bbox = (13.3, 52.45, 13.5, 52.55)
+        tiles = tiles_for_bbox(*bbox, 12)
+        self.assertEqual(len(tiles), tile_count(*bbox, 12))
+        self.assertEqual(len(set(tiles)), len(tiles))
+
+        x_min = min(tile_bbox(*tile)[0] for tile in tiles)
+        y_min = min(tile_bbox(*tile)[1] for tile in tiles)
+        x_max = max(tile_bbox(*tile)[2] for tile in tiles)
+        y_max = max(tile_bbox(*tile)[3] for tile in tiles)
+        self.assertTrue(x_min <= bbox[0] and bbox[2] <= x_max)
+        self.assertTrue(y_min <= bbox[1] and bbox[3] <= y_max)
+        for tile in tiles:
+            t_x_min, t_y_min, t_x_max, t_y_max = tile_bbox(*tile)
+            self.assertTrue(t_x_min < bbox[2] and bbox[0] < t_x_max)
+            self.assertTrue(t_y_min < bbox[3] and bbox[1] < t_y_max)
+
+    def test_inside_one_tile(self):
+        """Test a small bbox maps to the tile containing it."""
+        tiles = tiles_for_bbox(13.40, 52.51, 13.41, 52.52, 10)
+        self.assertEqual(tiles, [(10, 550, 335)])
+        x_min, y_min, x_max, y_max = tile_bbox(*tiles[0])
+        self.assertTrue(x_min <= 13.40 and 13.41 <= x_max)
+        self.assertTrue(y_min <= 52.51 and 52.52 <= y_max)
+
+    def test_world_edges(self):
+        """Test coordinates beyond the grid are clamped."""
+        self.assertEqual(tiles_for_bbox(-180, -90, 180, 90, 0), [(0, 0, 0)])
+        self.assertEqual(tile_count(-180, -90, 180, 90, 2), 16)
+        self.assertEqual(tiles_for_bbox(179.99, 89, 180, 90, 3), [(3, 7, 0)])
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(TileGridTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -1,17 +1,26 @@
+import itertools
+import os
+import sqlite3
+import time
+
 from PyQt5.QtCore import Qt
 from qgis.core import (
     Qgis,
+    QgsApplication,
     QgsCategorizedSymbolRenderer,
+    QgsCoordinateReferenceSystem,
     QgsFeature,
     QgsField,
     QgsFields,
     QgsFillSymbol,
     QgsGeometry,
     QgsMarkerSymbol,
-    QgsPointXY,
     QgsProject,
+    QgsRectangle,
     QgsRendererCategory,
     QgsSettings,
+    QgsUnitTypes,
+    QgsVectorFileWriter,
     QgsVectorLayer,
     QgsWkbTypes,
 )
@@ -23,18 +32,35 @@ from qgis.PyQt.QtWidgets import (
     QDialog,
     QFormLayout,
     QPushButton,
-    QMessageBox,
 )
 from qgis.utils import iface
 
-from .data_apis import OverpassAPIQueryStrategy, iDAIGazetteerAPIQueryStrategy
+from .data_apis import (
+    PROJECT_CRS,
+    OverpassAPIQueryStrategy,
+    iDAIGazetteerAPIQueryStrategy,
+)
 from .resources import *
+from .survey_filter import SurveyAreaFilter
+from .tasks import KgrQueryTask
+from .utils.clusters import cluster_boxes
+from .utils.features import feature_signature, hashable_value
 from .utils.logger import Logger
 
 Log = Logger()
 
+# Name prefix of the columns OSM tags are promoted to, see tagColumns
+TAG_COLUMN_PREFIX = "tag_"
+
+# Running query tasks. The task manager does not own the Python wrappers and
+# tools are replaced while their queries run, so the tasks are kept here.
+running_tasks = set()
+
 
 class FindKGRDataBaseTool(QgsMapTool):
+    # Number of elements whose geometries are built and reprojected at once
+    chunk_size = 2000
+
     def __init__(self, canvas):
         QgsMapTool.__init__(self, canvas)
         self.canvas = canvas
@@ -42,6 +68,12 @@ class FindKGRDataBaseTool(QgsMapTool):
         selected_settings_tags = QgsSettings().value("/KgrFinder/settings_tags", [])
         self.api_strategies = []
         self.polygons_features_must_be_within = []
+        # Bounding box of the survey polygons, the extent to query
+        self.survey_extent = QgsRectangle()
+        # layer id -> {(source, type, id): (feature id, signature)}, only for
+        # layers results are appended to
+        self.feature_index = {}
+        self.field_names = self.createFields().names()
 
         Log.log_debug(f"settings are {selected_settings_tags}")
 
@@ -51,93 +83,109 @@ class FindKGRDataBaseTool(QgsMapTool):
             self.api_strategies.append(iDAIGazetteerAPIQueryStrategy())
         Log.log_debug(str(self.api_strategies))
 
-    def checkAreaSize(self, x_min, y_min, x_max, y_max, threshold=1000000000):
-        area_sqm = (x_max - x_min) * (y_max - y_min)
-
-        # Conversion factors
-        sqm_to_km2 = 1 / 1_000_000
-        sqm_to_ha = 1 / 10_000
-
-        # Convert area to km² and ha
-        area_km2 = area_sqm * sqm_to_km2
-        area_ha = area_sqm * sqm_to_ha
-
-        # Convert threshold to km² and ha
-        threshold_km2 = threshold * sqm_to_km2
-        threshold_ha = threshold * sqm_to_ha
-
-        if area_sqm > threshold:
-            reply = QMessageBox.question(
-                iface.mainWindow(),
-                "WARNING: Large Polygon Detected",
-                f"WARNING: Large Polygon Detected \n\n"
-                f"The selected area is {area_km2:.2f} km², "
-                f"which exceeds the threshold of {threshold_km2:.2f} km².\n\n"
-                "Proceeding with this selection may result in a lengthy API request, potentially causing delays, "
-                "request failures, or QGIS crashing.\n\n"
-                "Do you still want to continue?",
-                QMessageBox.Yes | QMessageBox.No,
-                QMessageBox.No,
-            )
-
-            if reply == QMessageBox.No:
-                return None
-
-        return True
-
-
     def addFeature(self, feature):
         self.polygons_features_must_be_within.append(feature)
+        self.survey_extent.combineExtentWith(feature.geometry().boundingBox())
 
     def setSelectedLayer(self, selected_layer):
-        self.polygon_points = []
+        """Use the selected features of a polygon layer, or all of them when
+        nothing is selected, as survey polygons.
+
+        Features are streamed from the provider, only their bounding boxes
+        are merged into the query extent. The geometries, all parts of
+        multipolygons included, are kept as they are for the survey filter.
+        """
+        self.survey_extent = QgsRectangle()
 
         if not selected_layer.selectedFeatureCount():
             features = selected_layer.getFeatures()
         else:
-            features = selected_layer.selectedFeatures()
+            features = selected_layer.getSelectedFeatures()
 
         for feature in features:
             geometry = feature.geometry()
-            self.polygons_features_must_be_within.append(feature)
             if geometry.type() == QgsWkbTypes.PolygonGeometry:
-                polygons = (
-                    geometry.asMultiPolygon()[0]
-                    if geometry.wkbType() == QgsWkbTypes.MultiPolygon
-                    else [geometry.asPolygon()[0]]
-                )
-                for polygon in polygons:
-                    polygon_points = [QgsPointXY(point) for point in polygon]
-                    self.polygon_points.extend(polygon_points)
+                self.addFeature(feature)
 
     def processPolygonCoordinates(self):
-        outer_bounds_of_survey_polygons = QgsGeometry.fromPolygonXY(
-            [self.polygon_points]
+        if self.survey_extent.isNull():
+            iface.messageBar().pushMessage(
+                "KGR", "No survey polygons found", level=Qgis.Warning, duration=3
+            )
+            return
+
+        # Large areas are split into tiles by the strategies themselves
+        fields, point_layer, polygon_layer = self.createNewPolygonLayers()
+        self.addFeaturesByStrategy(
+            self.surveyAreas(),
+            fields,
+            polygon_layer,
+            point_layer,
         )
 
-        rect = outer_bounds_of_survey_polygons.boundingBox()
-
-        drawn_x_min = rect.xMinimum()
-        drawn_y_min = rect.yMinimum()
-        drawn_x_max = rect.xMaximum()
-        drawn_y_max = rect.yMaximum()
-        if self.checkAreaSize(drawn_x_min, drawn_y_min, drawn_x_max, drawn_y_max):
-            fields, point_layer, polygon_layer = self.createNewPolygonLayers()
-            self.addFeaturesByStrategy(
-                drawn_x_min,
-                drawn_y_min,
-                drawn_x_max,
-                drawn_y_max,
-                fields,
-                polygon_layer,
-                point_layer,
-            )
+    def surveyAreas(self):
+        """Group the survey polygons within the survey extent into clusters.
+
+        Polygons closer than ``/KgrFinder/cluster_distance_km`` to each other
+        are queried together, each cluster with its own bounding box, so
+        scattered sites do not download everything in between. The distance
+        is doubled until at most ``/KgrFinder/max_query_extents`` clusters
+        remain. Returns ``(extent, features)`` pairs.
+        """
+        features = []
+        boxes = []
+        for feature in self.polygons_features_must_be_within:
+            rect = feature.geometry().boundingBox()
+            if rect.intersects(self.survey_extent):
+                features.append(feature)
+                boxes.append(
+                    (rect.xMinimum(), rect.yMinimum(), rect.xMaximum(), rect.yMaximum())
+                )
+
+        crs = QgsProject.instance().crs()
+        distance = QgsSettings().value(
+            "/KgrFinder/cluster_distance_km", 5.0, type=float
+        ) * QgsUnitTypes.fromUnitToUnitFactor(
+            QgsUnitTypes.DistanceKilometers, crs.mapUnits()
+        )
+        max_extents = QgsSettings().value(
+            "/KgrFinder/max_query_extents", 16, type=int
+        )
+
+        clusters = cluster_boxes(boxes, distance)
+        while len(clusters) > max(1, max_extents):
+            distance = 2 * distance or max(
+                self.survey_extent.width(), self.survey_extent.height()
+            ) / max(1, max_extents)
+            clusters = cluster_boxes(boxes, distance)
+
+        Log.log_debug(f"querying {len(clusters)} survey areas")
+        return [
+            (extent, [features[index] for index in indices])
+            for extent, indices in clusters
+        ]
 
     def createNewPolygonLayers(self):
+        query_options = QgsSettings().value("/KgrFinder/query_options", [])
+        append = "Append to existing KGR layers" in query_options
+        if append:
+            layers = self.findKgrLayers()
+            if layers is not None:
+                point_layer, polygon_layer = layers
+                for layer in layers:
+                    self.indexLayer(layer)
+                return point_layer.fields(), point_layer, polygon_layer
+
         point_layer = self.createLayer("Point")
         fields = point_layer.fields()
 
-        polygon_layer = self.createLayer("Polygon")
+        # Multipolygon relations have several parts
+        polygon_layer = self.createLayer("MultiPolygon", "Polygon")
+        point_layer.setCustomProperty("kgr_finder/layer", "point")
+        polygon_layer.setCustomProperty("kgr_finder/layer", "polygon")
+        if append:
+            self.feature_index[point_layer.id()] = {}
+            self.feature_index[polygon_layer.id()] = {}
 
         root = QgsProject.instance().layerTreeRoot()
         group = root.insertGroup(0, "KGR")
@@ -157,106 +205,326 @@ class FindKGRDataBaseTool(QgsMapTool):
 
         return fields, point_layer, polygon_layer
 
+    def findKgrLayers(self):
+        """Return the point and polygon layer created by a previous query, or
+        None when there is no such pair in the result CRS and schema."""
+        crs = self.resultLayerCrs()
+        schema = [(field.name(), field.type()) for field in self.createFields()]
+        layers = {}
+        for layer in QgsProject.instance().mapLayers().values():
+            role = layer.customProperty("kgr_finder/layer")
+            if role not in ("point", "polygon") or layer.crs() != crs:
+                continue
+            fields = layer.fields()
+            if all(
+                fields.indexFromName(name) >= 0
+                and fields.field(name).type() == field_type
+                for name, field_type in schema
+            ):
+                layers.setdefault(role, layer)
+        if len(layers) < 2:
+            return None
+        return layers["point"], layers["polygon"]
+
+    def indexLayer(self, layer):
+        """Index the features of a result layer by source, type and id, so
+        results of later queries can be merged into it."""
+        index = {}
+        for feature in layer.getFeatures():
+            index[self.featureKey(feature)] = (
+                feature.id(),
+                self.featureSignature(feature),
+            )
+        self.feature_index[layer.id()] = index
+
+    def featureKey(self, feature):
+        # OSM ids are only unique per element type
+        return tuple(
+            hashable_value(feature[name]) for name in ("source", "type", "id")
+        )
+
+    def featureSignature(self, feature):
+        # Only the KGR fields, GeoPackage layers expose their fid as a field
+        return feature_signature(
+            (feature[name] for name in self.field_names), feature.geometry().asWkb()
+        )
+
     def addFeaturesByStrategy(
         self,
-        drawn_x_min,
-        drawn_y_min,
-        drawn_x_max,
-        drawn_y_max,
+        areas,
         fields,
         polygon_layer,
         point_layer,
     ):
-        for strategy in self.api_strategies:
-            data = strategy.query(drawn_x_min, drawn_y_min, drawn_x_max, drawn_y_max)
-            elements = strategy.extractElements(data)
-            attribute_mappings = strategy.getAttributeMappings()
-
-            for element in elements:
-                feature = self.createFeature(
-                    element, fields, attribute_mappings, strategy
-                )
+        task = KgrQueryTask(
+            self,
+            areas,
+            fields,
+            point_layer,
+            polygon_layer,
+        )
+        running_tasks.add(task)
+        task.taskCompleted.connect(lambda: running_tasks.discard(task))
+        task.taskTerminated.connect(lambda: running_tasks.discard(task))
+        QgsApplication.taskManager().addTask(task)
 
-                if feature is None:
+    def buildFeatures(
+        self,
+        strategy,
+        data,
+        fields,
+        survey_features,
+        progress=None,
+        destination_crs=PROJECT_CRS,
+        publish=None,
+    ):
+        """Create the features of one strategy response.
+
+        Runs on the worker thread of the query task and therefore only builds
+        features, the layers are filled by ``commitFeatures``. Geometries are
+        created in ``destination_crs``, the CRS of the result layers, which
+        the survey features must be in as well.
+
+        With ``publish`` given, it is called with the point and polygon
+        features of every chunk of ``chunk_size`` elements instead of
+        collecting them, and empty feature lists are returned.
+        """
+        elements = strategy.extractElements(data)
+        attribute_mappings = dict(strategy.getAttributeMappings())
+        if isinstance(strategy, OverpassAPIQueryStrategy):
+            for key in self.tagColumns():
+                attribute_mappings[TAG_COLUMN_PREFIX + key] = f"tags.{key}"
+        accessors = self.compileAttributeMappings(attribute_mappings, fields)
+        # Built per call, buildFeatures runs on one worker thread per strategy
+        survey_filter = SurveyAreaFilter(survey_features)
+        point_features = []
+        polygon_features = []
+        total = 0
+        elements = iter(elements)
+
+        while True:
+            # Geometries are reprojected in batches, see buildGeometries
+            chunk = list(itertools.islice(elements, self.chunk_size))
+            if not chunk:
+                break
+            total += len(chunk)
+            if progress is not None:
+                # Decoding the chunk advanced the response, report it
+                progress(strategy.progressFraction(data, total))
+
+            geometries = strategy.buildGeometries(chunk, destination_crs)
+
+            for element, geometry in zip(chunk, geometries):
+                if geometry is None:
                     continue
 
                 geometry_type = strategy.getGeometryType(element)
+                if not survey_filter.accepts(geometry, geometry_type):
+                    continue
 
-                for f in self.polygons_features_must_be_within:
-                    if geometry_type == "point" and f.geometry().contains(
-                        feature.geometry()
-                    ):
-                        point_layer.dataProvider().addFeature(feature)
-
-                    elif geometry_type == "polygon" and feature.geometry().intersects(
-                        f.geometry()
-                    ):
-                        polygon_layer.dataProvider().addFeature(feature)
-
-            print("here")
-            print(elements)
-
-            if len(elements) == 0:
-                iface.messageBar().pushMessage(
-                    "KGR",
-                    "No Data from " + strategy.source + " received",
-                    level=Qgis.Warning,
-                    duration=3,
-                )
-            else:
-                iface.messageBar().pushMessage(
-                    "KGR",
-                    "Data from " + strategy.source + " loaded",
-                    level=Qgis.Success,
-                    duration=3,
+                feature = self.createFeature(
+                    element, fields, accessors, strategy, geometry
                 )
 
-    def createFeature(self, element, fields, attribute_mappings, strategy):
-        geometry_type = strategy.getGeometryType(element)
-
-        if geometry_type == "point":
-            lat, lon = strategy.extractLatLon(element)
-            if lat is not None and lon is not None:
-                point = QgsPointXY(lon, lat)
-                geometry = QgsGeometry.fromPointXY(point)
-        elif geometry_type == "polygon":
-            polygonNodes = strategy.extractPolygonNodes(element)
-            if polygonNodes:
-                polygon = QgsGeometry.fromPolygonXY([polygonNodes])
-                geometry = polygon
-            else:
-                return None
+                if geometry_type == "point":
+                    point_features.append(feature)
+                elif geometry_type in ("polygon", "multipolygon"):
+                    polygon_features.append(feature)
+
+            if publish is not None and (point_features or polygon_features):
+                publish(point_features, polygon_features)
+                point_features = []
+                polygon_features = []
+
+        return point_features, polygon_features, total
+
+    def commitFeatures(
+        self, point_layer, polygon_layer, point_features, polygon_features
+    ):
+        """Add the features with one addFeatures call per layer and chunk.
+
+        For layers in ``feature_index`` features already in the layer are
+        updated in place when their attributes or geometry changed and only
+        unseen features are added.
+
+        Signals of the layers and their providers are blocked while loading,
+        call ``updateLayers`` once all features are committed.
+        """
+        for layer, features in (
+            (point_layer, point_features),
+            (polygon_layer, polygon_features),
+        ):
+            if not features:
+                continue
+            index = self.feature_index.get(layer.id())
+            provider = layer.dataProvider()
+            layer.blockSignals(True)
+            provider.blockSignals(True)
+            try:
+                if index is not None:
+                    features = self.updateFeatures(provider, features, index)
+                for start in range(0, len(features), self.chunk_size):
+                    _, added = provider.addFeatures(
+                        features[start : start + self.chunk_size]
+                    )
+                    if index is not None:
+                        for feature in added:
+                            index[self.featureKey(feature)] = (
+                                feature.id(),
+                                self.featureSignature(feature),
+                            )
+            finally:
+                provider.blockSignals(False)
+                layer.blockSignals(False)
+
+    def updateFeatures(self, provider, features, index):
+        """Update the indexed features that changed and return the others."""
+        primary_keys = set(provider.pkAttributeIndexes())
+        unseen = []
+        attribute_changes = {}
+        geometry_changes = {}
+        for feature in features:
+            key = self.featureKey(feature)
+            signature = self.featureSignature(feature)
+            if key not in index:
+                unseen.append(feature)
+                continue
+            feature_id, old_signature = index[key]
+            if signature != old_signature:
+                attribute_changes[feature_id] = {
+                    field_index: value
+                    for field_index, value in enumerate(feature.attributes())
+                    if field_index not in primary_keys
+                }
+                geometry_changes[feature_id] = feature.geometry()
+                index[key] = (feature_id, signature)
+
+        if attribute_changes:
+            provider.changeAttributeValues(attribute_changes)
+            provider.changeGeometryValues(geometry_changes)
+        return unseen
+
+    def updateLayers(self, *layers):
+        for layer in layers:
+            layer.updateExtents()
+            layer.triggerRepaint()
+
+    def reportStrategyResult(self, strategy, count):
+        if count == 0:
+            message = "No Data from " + strategy.source + " received"
+            if strategy.last_error:
+                message += f" ({strategy.last_error})"
+            iface.messageBar().pushMessage(
+                "KGR",
+                message,
+                level=Qgis.Warning,
+                duration=3,
+            )
+        elif strategy.incomplete:
+            message = "Data from " + strategy.source + " is incomplete"
+            if strategy.last_error:
+                message += f" ({strategy.last_error})"
+            iface.messageBar().pushMessage(
+                "KGR",
+                message,
+                level=Qgis.Warning,
+                duration=5,
+            )
         else:
-            return None
+            iface.messageBar().pushMessage(
+                "KGR",
+                "Data from " + strategy.source + " loaded",
+                level=Qgis.Success,
+                duration=3,
+            )
+
+    def compileAttributeMappings(self, attribute_mappings, fields):
+        """Parse the attribute mappings of a strategy once per query.
+
+        Returns ``(field index, path, convert)`` triples for the mapped
+        fields. A path is the key of a top level member or a tuple of
+        ``(key, index, part)`` steps for dotted mappings, index being None for
+        plain keys, so createFeature only does the lookups for every element.
+        ``convert`` turns the value into the type of the field.
+        """
+        accessors = []
+        for attribute, mapping in attribute_mappings.items():
+            field_index = fields.indexFromName(attribute)
+            if field_index < 0:
+                continue
+            convert = self.attributeConverter(fields.at(field_index))
+            if "." not in mapping:
+                accessors.append((field_index, mapping, convert))
+                continue
+
+            path = []
+            for part in mapping.split("."):
+                if "[" in part and "]" in part:
+                    # Handle indexed mappings
+                    key, index = part.split("[")
+                    path.append((key, int(index.rstrip("]")), part))
+                else:
+                    path.append((part, None, part))
+            accessors.append((field_index, tuple(path), convert))
+        return accessors
+
+    def attributeConverter(self, field):
+        """Return the function converting API values for ``field``. Missing
+        values become NULL, or "-" for text fields."""
+        if field.name().startswith(TAG_COLUMN_PREFIX):
+            # Tag values repeat a lot, features share one QVariant per value
+            values = {}
+
+            def intern(value):
+                if not value or not isinstance(value, str):
+                    return None
+                variant = values.get(value)
+                if variant is None:
+                    variant = values[value] = QVariant(value)
+                return variant
+
+            return intern
+
+        if field.type() == QVariant.Map:
+            return lambda value: value if value and isinstance(value, dict) else None
+
+        if field.type() in (QVariant.Double, QVariant.LongLong):
+            cast = float if field.type() == QVariant.Double else int
 
+            def convert(value):
+                try:
+                    return cast(value)
+                except (TypeError, ValueError):
+                    return None
+
+            return convert
+
+        return lambda value: str(value) if value else "-"
+
+    def createFeature(self, element, fields, accessors, strategy, geometry):
         feature = QgsFeature(fields)
         feature.setGeometry(geometry)
 
-        # Iterate over attribute_mappings and set attributes
-        for attribute, mapping in attribute_mappings.items():
-            if "." in mapping:
-                parts = mapping.split(".")
+        attributes = [None] * fields.count()
+        for field_index, path, convert in accessors:
+            if isinstance(path, str):
+                value = element.get(path, "")
+            else:
                 value = element
-                for part in parts:
-                    if "[" in part and "]" in part:
-                        # Handle indexed mappings
-                        base_part, index = part.split("[")
-                        index = int(index.rstrip("]"))
-                        try:
-                            value = value.get(base_part, [])[index]
-                        except IndexError:
-                            value = value.get(part, {})
-                            pass
-                    else:
+                for key, index, part in path:
+                    if not isinstance(value, dict):
+                        # e.g. the iDAI "tags" list
+                        value = None
+                        break
+                    if index is None:
+                        value = value.get(key, {})
+                        continue
+                    try:
+                        value = value.get(key, [])[index]
+                    except IndexError:
                         value = value.get(part, {})
-            else:
-                if mapping.startswith("tags."):
-                    tag_key = mapping.split("tags.")[1]
-                    value = element["tags"].get(tag_key, "")
-                else:
-                    value = element.get(mapping, "")
-            value = str(value) if value else "-"
-            feature.setAttribute(attribute, value)
+            attributes[field_index] = convert(value)
+        feature.setAttributes(attributes)
 
         feature.setAttribute("source", f"{strategy.source}")
 
@@ -264,23 +532,49 @@ class FindKGRDataBaseTool(QgsMapTool):
 
     def createFields(self):
         fields = QgsFields()
-        fields.append(QgsField("lon", QVariant.String))
-        fields.append(QgsField("lat", QVariant.String))
+        fields.append(QgsField("lon", QVariant.Double))
+        fields.append(QgsField("lat", QVariant.Double))
         fields.append(QgsField("name", QVariant.String))
         fields.append(QgsField("source", QVariant.String))
         fields.append(QgsField("description", QVariant.String, "string", 9000))
         fields.append(QgsField("type", QVariant.String))
-        fields.append(QgsField("id", QVariant.String))
-        fields.append(QgsField("tags", QVariant.String, "json", 9000))
+        # OSM element ids and iDAI gazetteer ids are both integers
+        fields.append(QgsField("id", QVariant.LongLong))
+        # Tag dicts are kept as maps, stored as JSON
+        fields.append(QgsField("tags", QVariant.Map, "json"))
+        for key in self.tagColumns():
+            fields.append(QgsField(TAG_COLUMN_PREFIX + key, QVariant.String))
 
         return fields
 
-    def createLayer(self, geometryType):
+    def resultLayerCrs(self):
+        query_options = QgsSettings().value("/KgrFinder/query_options", [])
+        if "Store results in EPSG:4326" in query_options:
+            # Keep the API coordinates, QGIS reprojects them for display
+            return QgsCoordinateReferenceSystem("EPSG:4326")
+        return QgsProject.instance().crs()
+
+    def tagColumns(self):
+        """Return the OSM tag keys configured to get columns of their own."""
+        keys = QgsSettings().value("/KgrFinder/tag_columns", [])
+        if isinstance(keys, str):
+            keys = [keys]
+        return list(dict.fromkeys(key.strip() for key in keys if key.strip()))
+
+    def createLayer(self, geometryType, name=None):
         fields = self.createFields()
-        project_crs = QgsProject.instance().crs()
+        crs = self.resultLayerCrs()
+        layer_name = f"KGR ({(name or geometryType).capitalize()})"
+
+        query_options = QgsSettings().value("/KgrFinder/query_options", [])
+        if "Store results in a GeoPackage" in query_options:
+            layer = self.createGeoPackageLayer(geometryType, layer_name, fields, crs)
+            if layer is not None:
+                return layer
+
         layer = QgsVectorLayer(
-            f"{geometryType}?crs={project_crs.authid()}",
-            f"KGR ({geometryType.capitalize()})",
+            f"{geometryType}?crs={crs.authid()}",
+            layer_name,
             "memory",
         )
         layer.dataProvider().addAttributes(fields)
@@ -288,6 +582,77 @@ class FindKGRDataBaseTool(QgsMapTool):
 
         return layer
 
+    def createGeoPackageLayer(self, geometryType, layer_name, fields, crs):
+        """Create a new table with an R-tree spatial index in the result
+        GeoPackage and return it as layer, or None if that fails.
+
+        The file is ``/KgrFinder/geopackage_path``, by default kgr_results.gpkg
+        in the plugin's settings directory. Every query gets its own tables,
+        the OGR provider wraps every addFeatures call in a transaction.
+        Existing tables are never overwritten.
+        """
+        path = QgsSettings().value("/KgrFinder/geopackage_path", "") or os.path.join(
+            QgsApplication.qgisSettingsDirPath(), "kgr_finder", "kgr_results.gpkg"
+        )
+        existing = self.geoPackageTables(path)
+        if existing is None:
+            return None
+        base = f"kgr_{geometryType.lower()}_{time.strftime('%Y%m%d_%H%M%S')}"
+        table = base
+        number = 1
+        # Cached queries easily finish twice within a second
+        while table.lower() in existing:
+            number += 1
+            table = f"{base}_{number}"
+
+        options = QgsVectorFileWriter.SaveVectorOptions()
+        options.driverName = "GPKG"
+        options.layerName = table
+        options.layerOptions = ["SPATIAL_INDEX=YES"]
+        if os.path.exists(path):
+            # Only adds the table, which does not exist yet
+            options.actionOnExistingFile = QgsVectorFileWriter.CreateOrOverwriteLayer
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            options.actionOnExistingFile = QgsVectorFileWriter.CreateOrOverwriteFile
+
+        writer = QgsVectorFileWriter.create(
+            path,
+            fields,
+            QgsWkbTypes.parseType(geometryType),
+            crs,
+            QgsProject.instance().transformContext(),
+            options,
+        )
+        error = writer.hasError()
+        message = writer.errorMessage()
+        # The table is written when the writer is deleted
+        del writer
+        if error != QgsVectorFileWriter.NoError:
+            Log.log_error(f"could not create {table} in {path}: {message}")
+            return None
+
+        layer = QgsVectorLayer(f"{path}|layername={table}", layer_name, "ogr")
+        if not layer.isValid():
+            Log.log_error(f"could not open {table} in {path}")
+            return None
+        return layer
+
+    def geoPackageTables(self, path):
+        """Return the lower case names of the tables in a GeoPackage, or None
+        if the file cannot be read."""
+        if not os.path.exists(path):
+            return set()
+        connection = sqlite3.connect(path)
+        try:
+            rows = connection.execute("SELECT name FROM sqlite_master").fetchall()
+        except sqlite3.DatabaseError as e:
+            Log.log_error(f"could not read {path}: {e}")
+            return None
+        finally:
+            connection.close()
+        return {name.lower() for name, in rows}
+
     def createCategorizedRendererPoints(self, layer):
         categorized_renderer = QgsCategorizedSymbolRenderer("source")
 
@@ -367,6 +732,10 @@ class DrawPolygonTool(FindKGRDataBaseTool):
         else:
             self.is_drawing = True
             self.polygon_points = [self.toMapCoordinates(event.pos())]
+            # Query the new polygon only, earlier drawings would otherwise
+            # join its clusters and be queried again
+            self.polygons_features_must_be_within = []
+            self.survey_extent = QgsRectangle()
             self.updateRubberBand()
             self.rubber_band.show()
 
@@ -381,7 +750,7 @@ class DrawPolygonTool(FindKGRDataBaseTool):
                 polygon_geometry = QgsGeometry.fromPolygonXY([self.polygon_points])
                 feature = QgsFeature()
                 feature.setGeometry(polygon_geometry)
-                self.polygons_features_must_be_within.append(feature)
+                self.addFeature(feature)
 
                 self.processPolygonCoordinates()
 
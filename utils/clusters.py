@@ -0,0 +1,47 @@
+def cluster_boxes(boxes, distance):
+    """Group bounding boxes lying within ``distance`` of each other.
+
+    ``boxes`` are ``(x_min, y_min, x_max, y_max)`` tuples. Boxes are swept
+    in order of ``x_min`` and joined with a union-find whenever the gap
+    between two of them is at most ``distance`` on both axes, so chains of
+    nearby boxes end up in one cluster. Returns ``(bbox, indices)`` pairs
+    with the bounding box of each cluster and the indices of its boxes.
+    """
+    parents = list(range(len(boxes)))
+
+    def find(index):
+        while parents[index] != index:
+            parents[index] = parents[parents[index]]
+            index = parents[index]
+        return index
+
+    order = sorted(range(len(boxes)), key=lambda index: boxes[index][0])
+    active = []
+    for index in order:
+        x_min, y_min, x_max, y_max = boxes[index]
+        # Boxes ending too far left cannot be joined with this or later boxes
+        active = [other for other in active if boxes[other][2] + distance >= x_min]
+        for other in active:
+            other_y_min, other_y_max = boxes[other][1], boxes[other][3]
+            if other_y_min - distance <= y_max and y_min <= other_y_max + distance:
+                parents[find(other)] = find(index)
+        active.append(index)
+
+    clusters = {}
+    for index, box in enumerate(boxes):
+        root = find(index)
+        if root in clusters:
+            bbox, indices = clusters[root]
+            clusters[root] = (
+                (
+                    min(bbox[0], box[0]),
+                    min(bbox[1], box[1]),
+                    max(bbox[2], box[2]),
+                    max(bbox[3], box[3]),
+                ),
+                indices,
+            )
+            indices.append(index)
+        else:
+            clusters[root] = (tuple(box), [index])
+    return list(clusters.values())
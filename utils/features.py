@@ -0,0 +1,22 @@
+def hashable_value(value):
+    """Return an attribute value in a form that can be hashed.
+
+    NULL attributes come back from PyQt as unhashable QVariant objects and
+    are mapped to None, map attributes to their sorted items.
+    """
+    if value is None:
+        return None
+    if isinstance(value, dict):
+        return tuple(sorted((key, hashable_value(item)) for key, item in value.items()))
+    if isinstance(value, list):
+        return tuple(hashable_value(item) for item in value)
+    is_null = getattr(value, "isNull", None)
+    if is_null is not None and is_null():
+        return None
+    return value
+
+
+def feature_signature(values, wkb):
+    """Return a hash of attribute values and a WKB geometry, to tell whether
+    a stored feature differs from a fetched one."""
+    return hash((tuple(hashable_value(value) for value in values), bytes(wkb)))
@@ -0,0 +1,116 @@
+import codecs
+import json
+
+_WHITESPACE = " \t\n\r"
+_DELIMITERS = _WHITESPACE + ",]}"
+
+
+class JSONArrayStream:
+    """Incrementally decode the items of one array member of a JSON object.
+
+    ``chunks`` is an iterable of ``bytes``. Iterating the stream yields the
+    items of the top level member ``key`` one by one, decoding only as much
+    of the input as needed, so the document is never materialised as a
+    whole. All other top level members are decoded into ``extras`` as they
+    are passed.
+    """
+
+    def __init__(self, chunks, key):
+        self.chunks = iter(chunks)
+        self.key = key
+        self.extras = {}
+        self._decoder = json.JSONDecoder()
+        self._utf8 = codecs.getincrementaldecoder("utf-8")()
+        self._buffer = ""
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self):
+        """Append the next chunk to the buffer, return False at the end."""
+        if self._eof:
+            return False
+        if self._pos > 65536 and self._pos > len(self._buffer) // 2:
+            self._buffer = self._buffer[self._pos :]
+            self._pos = 0
+        for chunk in self.chunks:
+            text = self._utf8.decode(chunk)
+            if text:
+                self._buffer += text
+                return True
+        self._buffer += self._utf8.decode(b"", final=True)
+        self._eof = True
+        return False
+
+    def _peek(self):
+        """Skip whitespace and return the next character or None at the end."""
+        while True:
+            while (
+                self._pos < len(self._buffer)
+                and self._buffer[self._pos] in _WHITESPACE
+            ):
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                return None
+
+    def _expect(self, characters):
+        char = self._peek()
+        if char is None or char not in characters:
+            raise ValueError(
+                f"expected one of {characters!r} at offset {self._pos}, got {char!r}"
+            )
+        self._pos += 1
+        return char
+
+    def _value(self):
+        """Decode the next JSON value, reading more input while it is cut off."""
+        self._peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+            except json.JSONDecodeError:
+                if self._fill():
+                    continue
+                raise
+            # A number cut off by the end of the buffer decodes fine but might
+            # continue in the next chunk
+            if (
+                end == len(self._buffer)
+                or isinstance(value, (int, float))
+                and self._buffer[end] not in _DELIMITERS
+            ) and self._fill():
+                continue
+            self._pos = end
+            return value
+
+    def __iter__(self):
+        self._expect("{")
+        if self._peek() == "}":
+            self._pos += 1
+            return
+
+        while True:
+            member = self._value()
+            self._expect(":")
+            if member == self.key and self._peek() == "[":
+                self._pos += 1
+                if self._peek() == "]":
+                    self._pos += 1
+                else:
+                    while True:
+                        yield self._value()
+                        if self._expect(",]") == "]":
+                            break
+            else:
+                self.extras[member] = self._value()
+
+            if self._expect(",}") == "}":
+                return
+
+
+def iter_chunks(content, chunk_size=1 << 16):
+    """Yield ``content`` in slices of ``chunk_size`` bytes."""
+    view = memoryview(content)
+    for start in range(0, len(view), chunk_size):
+        yield bytes(view[start : start + chunk_size])
@@ -0,0 +1,282 @@
+from array import array
+from bisect import bisect_left
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class NodeIndex:
+    """Compact id -> coordinate store for the nodes of an Overpass response.
+
+    Ids and coordinates live in parallel typed arrays (int64 ids, float64
+    longitudes and latitudes) instead of a dict of tuples, which takes a
+    fraction of the memory for millions of nodes. Lookups are binary
+    searches over the sorted ids, vectorized with NumPy when available.
+    Overpass returns nodes sorted by id; unsorted input is sorted once
+    before the first lookup.
+    """
+
+    def __init__(self):
+        self.ids = array("q")
+        self.lons = array("d")
+        self.lats = array("d")
+        self._sorted = True
+        self._views = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, node_id, lon, lat):
+        # NumPy views export the buffers, which blocks resizing the arrays
+        self._views = None
+        if self.ids and node_id <= self.ids[-1]:
+            self._sorted = False
+        self.ids.append(node_id)
+        self.lons.append(lon)
+        self.lats.append(lat)
+
+    def _prepare(self):
+        if not self._sorted:
+            self._views = None
+            order = sorted(range(len(self.ids)), key=self.ids.__getitem__)
+            self.ids = array("q", (self.ids[i] for i in order))
+            self.lons = array("d", (self.lons[i] for i in order))
+            self.lats = array("d", (self.lats[i] for i in order))
+            self._sorted = True
+
+        if numpy is not None and self._views is None:
+            self._views = (
+                numpy.frombuffer(self.ids, dtype=numpy.int64),
+                numpy.frombuffer(self.lons, dtype=numpy.float64),
+                numpy.frombuffer(self.lats, dtype=numpy.float64),
+            )
+
+    def resolve(self, node_ids):
+        """Return the coordinates of ``node_ids`` as a flat array
+        ``lon0, lat0, lon1, lat1, ...``. Unknown ids are skipped."""
+        self._prepare()
+        coordinates = array("d")
+        if not self.ids:
+            return coordinates
+
+        if self._views is not None:
+            ids, lons, lats = self._views
+            wanted = numpy.asarray(node_ids, dtype=numpy.int64)
+            positions = numpy.searchsorted(ids, wanted)
+            positions[positions == len(ids)] = 0
+            positions = positions[ids[positions] == wanted]
+            interleaved = numpy.empty(2 * len(positions))
+            interleaved[0::2] = lons[positions]
+            interleaved[1::2] = lats[positions]
+            coordinates.frombytes(interleaved.tobytes())
+            return coordinates
+
+        ids = self.ids
+        count = len(ids)
+        for node_id in node_ids:
+            position = bisect_left(ids, node_id)
+            if position < count and ids[position] == node_id:
+                coordinates.append(self.lons[position])
+                coordinates.append(self.lats[position])
+        return coordinates
+
+
+def overpass_query(tags, areas, geometry_mode="nodes"):
+    """Return the Overpass QL query for the ``key`` or ``key=value`` search
+    terms in ``tags`` within the bbox or poly: filters ``areas``.
+
+    Nodes, ways and multipolygon relations are queried. In "nodes" mode the
+    member nodes of the ways and the member ways and nodes of the relations
+    are recursed right after every statement, as ``>`` only recurses the
+    result of the statement before it.
+    """
+    recurse = ">;" if geometry_mode == "nodes" else ""
+    query = "[out:json];("
+    for search_term in tags:
+        key, sep, value = search_term.partition("=")
+        key, value = [f"'{value}'" if value else "" for value in (key, value)]
+        for area in areas:
+            query += f"node[{key}{sep}{value}]{area};"
+            query += f"way[{key}{sep}{value}]{area};{recurse}"
+            query += (
+                f"relation[{key}{sep}{value}]['type'='multipolygon']{area};{recurse}"
+            )
+
+    if geometry_mode == "geom":
+        return query + ");out geom;"
+    elif geometry_mode == "center":
+        return query + ");out center;"
+    return query + ");out;"
+
+
+def _reversed_pairs(coordinates):
+    """Return the flat coordinate array with the order of its points reversed."""
+    result = array("d", coordinates)
+    result[0::2] = coordinates[-2::-2]
+    result[1::2] = coordinates[-1::-2]
+    return result
+
+
+def stitch_rings(lines):
+    """Join ways sharing end points into closed rings.
+
+    ``lines`` are flat coordinate arrays ``x0, y0, x1, y1, ...``. Open ways
+    are indexed by both of their end points, so finding the continuation of
+    a ring is a dict lookup and every way is visited once, however many
+    members a relation has. Ways are reversed where needed. Rings that
+    cannot be closed or have fewer than four points are dropped.
+    """
+    rings = []
+    open_lines = {}
+    endpoints = {}
+    for line in lines:
+        if len(line) < 4:
+            continue
+        first = (line[0], line[1])
+        last = (line[-2], line[-1])
+        if first == last:
+            if len(line) >= 8:
+                rings.append(line)
+            continue
+        index = len(open_lines)
+        open_lines[index] = line
+        endpoints.setdefault(first, []).append(index)
+        endpoints.setdefault(last, []).append(index)
+
+    while open_lines:
+        index, line = open_lines.popitem()
+        start = (line[0], line[1])
+        end = (line[-2], line[-1])
+        endpoints[start].remove(index)
+        endpoints[end].remove(index)
+        ring = array("d", line)
+
+        while end != start:
+            candidates = endpoints.get(end)
+            if not candidates:
+                break
+            index = candidates.pop()
+            line = open_lines.pop(index)
+            first = (line[0], line[1])
+            last = (line[-2], line[-1])
+            if first == end:
+                far = last
+            else:
+                line = _reversed_pairs(line)
+                far = first
+            endpoints[far].remove(index)
+            ring.extend(line[2:])
+            end = far
+
+        if end == start and len(ring) >= 8:
+            rings.append(ring)
+
+    return rings
+
+
+def ring_contains(ring, x, y):
+    """Even-odd test whether the point lies inside the flat coordinate ring."""
+    inside = False
+    x1, y1 = ring[-2], ring[-1]
+    for i in range(0, len(ring), 2):
+        x2, y2 = ring[i], ring[i + 1]
+        if (y2 > y) != (y1 > y) and x < (x1 - x2) * (y - y2) / (y1 - y2) + x2:
+            inside = not inside
+        x1, y1 = x2, y2
+    return inside
+
+
+def assemble_multipolygon(members):
+    """Build the polygons of a multipolygon relation.
+
+    ``members`` yields ``(role, coordinates)`` for the member ways, with
+    flat coordinate arrays. Outer and inner ways are stitched into rings
+    separately (an empty role counts as outer) and every inner ring is
+    assigned to the outer ring containing it. Returns a list of polygons,
+    each a list of rings starting with the outer ring.
+    """
+    outer_lines = []
+    inner_lines = []
+    for role, coordinates in members:
+        if coordinates is not None:
+            (inner_lines if role == "inner" else outer_lines).append(coordinates)
+
+    polygons = [[ring] for ring in stitch_rings(outer_lines)]
+    if not polygons:
+        return []
+
+    boxes = [
+        (min(ring[0::2]), min(ring[1::2]), max(ring[0::2]), max(ring[1::2]))
+        for ring, in polygons
+    ]
+    for ring in stitch_rings(inner_lines):
+        x, y = ring[0], ring[1]
+        candidates = [
+            polygon
+            for polygon, (x_min, y_min, x_max, y_max) in zip(polygons, boxes)
+            if x_min <= x <= x_max and y_min <= y <= y_max
+        ]
+        if len(candidates) > 1:
+            # A vertex on the outer ring itself may fail the test, fall back
+            # to the first candidate then
+            candidates = [
+                polygon for polygon in candidates if ring_contains(polygon[0], x, y)
+            ] or candidates
+        if candidates:
+            candidates[0].append(ring)
+
+    return polygons
+
+
+def matches_search_terms(tags, search_terms):
+    """Whether the tags of an element match any of the ``key`` or
+    ``key=value`` search terms of overpass_query."""
+    for search_term in search_terms:
+        key, sep, value = search_term.partition("=")
+        if key in tags and (not sep or tags[key] == value):
+            return True
+    return False
+
+
+def restructure_elements(elements, search_terms):
+    """Attach node coordinates to the ways and relations of a streamed
+    Overpass response.
+
+    Overpass sorts its output by type, so all nodes arrive before the ways
+    referencing them and ways before relations. Nodes are stored in a
+    NodeIndex as they pass, ways get their geometry as a flat
+    ``coordinates`` array (``lon0, lat0, lon1, lat1, ...``) replacing the
+    list of node ids. Multipolygon relations get their member ways
+    assembled into ``polygons``, see assemble_multipolygon.
+
+    Recursing ways and relations also returns their members, which may
+    carry unrelated tags of their own. Only nodes and ways matching the
+    query ``search_terms`` are yielded, like an "out geom" query would, and
+    as soon as they are complete. Elements are modified in place, nothing
+    is copied.
+    """
+    index = NodeIndex()
+    way_coordinates = {}
+
+    for element in elements:
+        if element["type"] == "node":
+            index.add(element["id"], element["lon"], element["lat"])
+            if matches_search_terms(element.get("tags", {}), search_terms):
+                yield element
+        elif element["type"] == "way":
+            coordinates = index.resolve(element.pop("nodes"))
+            element["coordinates"] = coordinates
+            way_coordinates[element["id"]] = coordinates
+            if matches_search_terms(element.get("tags", {}), search_terms):
+                yield element
+        elif element["type"] == "relation" and "members" in element:
+            element["polygons"] = assemble_multipolygon(
+                (member["role"], way_coordinates.get(member["ref"]))
+                for member in element.pop("members")
+                if member["type"] == "way"
+            )
+            yield element
+        else:
+            yield element
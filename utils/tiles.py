@@ -0,0 +1,49 @@
+import math
+
+# Web mercator is undefined at the poles, clamp latitudes to its bounds
+MAX_LATITUDE = 85.0511287798
+
+
+def lon_to_tile_x(lon, zoom):
+    n = 2**zoom
+    return min(max(int((lon + 180.0) / 360.0 * n), 0), n - 1)
+
+
+def lat_to_tile_y(lat, zoom):
+    n = 2**zoom
+    lat = min(max(lat, -MAX_LATITUDE), MAX_LATITUDE)
+    lat_rad = math.radians(lat)
+    y = (1.0 - math.asinh(math.tan(lat_rad)) / math.pi) / 2.0 * n
+    return min(max(int(y), 0), n - 1)
+
+
+def tile_bbox(zoom, x, y):
+    """Return the (lon_min, lat_min, lon_max, lat_max) bounds of a tile."""
+    n = 2**zoom
+
+    def tile_lat(tile_y):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * tile_y / n))))
+
+    lon_min = x / n * 360.0 - 180.0
+    lon_max = (x + 1) / n * 360.0 - 180.0
+    return lon_min, tile_lat(y + 1), lon_max, tile_lat(y)
+
+
+def tiles_for_bbox(x_min, y_min, x_max, y_max, zoom):
+    """Return the (zoom, x, y) tiles of the fixed grid covering a 4326 bbox."""
+    tx_min = lon_to_tile_x(x_min, zoom)
+    tx_max = lon_to_tile_x(x_max, zoom)
+    # tile rows grow southwards
+    ty_min = lat_to_tile_y(y_max, zoom)
+    ty_max = lat_to_tile_y(y_min, zoom)
+    return [
+        (zoom, x, y)
+        for x in range(tx_min, tx_max + 1)
+        for y in range(ty_min, ty_max + 1)
+    ]
+
+
+def tile_count(x_min, y_min, x_max, y_max, zoom):
+    tx = lon_to_tile_x(x_max, zoom) - lon_to_tile_x(x_min, zoom) + 1
+    ty = lat_to_tile_y(y_min, zoom) - lat_to_tile_y(y_max, zoom) + 1
+    return tx * ty